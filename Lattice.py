@@ -0,0 +1,70 @@
+# The geometry of the LxL torus, precomputed once per gridsize and shared by all decoders
+
+from array import array
+from functools import lru_cache, cached_property
+
+
+class Lattice:
+    """Index tables of the toric code of size L.
+    Vertex (stabilizer) (row, col) has id row*L+col, edge (qubit) (q_row, q_col) of the 2LxL qubit grid
+    has id q_row*L+q_col. Qubit (2*row, col) is between stabilizers (row, col) and (row-1, col),
+    qubit (2*row+1, col) between stabilizers (row, col) and (row, col-1).
+    The tables of coordinate tuples are only built when used, they take most of the memory at large L."""
+
+    def __init__(self, L):
+        """Build all tables for gridsize L"""
+        self.L = L
+        self.n_vertices = L * L
+        self.n_edges = 2 * L * L
+        # for vertex v: neighbours[4*v+k] is the k-th neighbouring vertex (under, right, above, left),
+        # vertex_edges[4*v+k] the edge to it
+        self.neighbours = array('i', [v for row in range(L) for col in range(L) for v in (
+            ((row + 1) % L) * L + col, row * L + (col + 1) % L, ((row - 1) % L) * L + col, row * L + (col - 1) % L)])
+        self.vertex_edges = array('i', [e for row in range(L) for col in range(L) for e in (
+            2 * ((row + 1) % L) * L + col,  # qubit under
+            (2 * row + 1) * L + (col + 1) % L,  # qubit right
+            2 * row * L + col,  # qubit above
+            (2 * row + 1) * L + col)])  # qubit left
+        # for edge e = q_row*L+q_col: the two vertices it connects, the first is (q_row // 2, q_col)
+        self.edge_u = array('i', [(q_row // 2) * L + q_col for q_row in range(2 * L) for q_col in range(L)])
+        self.edge_v = array('i', [((q_row // 2 - 1) % L) * L + q_col if q_row % 2 == 0  # stabilizer above the qubit
+                                  else (q_row // 2) * L + (q_col - 1) % L  # stabilizer left of the qubit
+                                  for q_row in range(2 * L) for q_col in range(L)])
+        # distance on the torus in one direction, for a difference d of rows or columns: min(|d|, L-|d|)
+        self.torus_distance = array('i', [min(d, L - d) for d in range(L)])
+
+    @cached_property
+    def vertex_coords(self):
+        """(row, col) of each vertex id"""
+        return [(row, col) for row in range(self.L) for col in range(self.L)]
+
+    @cached_property
+    def edge_stabs(self):
+        """(stab1, stab2) of each edge id, like make_erasure gives"""
+        coords = self.vertex_coords
+        return [(coords[u], coords[v]) for u, v in zip(self.edge_u, self.edge_v)]
+
+    def vertex_id(self, stab):
+        """Returns the id of stabilizer stab = (row, col)"""
+        return stab[0] * self.L + stab[1]
+
+    def edge_between(self, u, v):
+        """Returns the id of the edge between the neighbouring vertices with ids u and v"""
+        for k in range(4):
+            if self.neighbours[4 * u + k] == v:
+                return self.vertex_edges[4 * u + k]
+        raise ValueError('vertices ' + str(u) + ' and ' + str(v) + ' are not neighbours')
+
+    def edge_id(self, stab1, stab2):
+        """Returns the id of the edge between the neighbouring stabilizers stab1 and stab2"""
+        return self.edge_between(stab1[0] * self.L + stab1[1], stab2[0] * self.L + stab2[1])
+
+    def qubit(self, stab1, stab2):
+        """Returns the (row, col) of the qubit between the neighbouring stabilizers stab1 and stab2"""
+        return divmod(self.edge_id(stab1, stab2), self.L)
+
+
+@lru_cache(maxsize=32)
+def get_lattice(L):
+    """Returns the Lattice of gridsize L, built on first use, the most recently used gridsizes are kept"""
+    return Lattice(L)
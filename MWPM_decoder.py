@@ -1,49 +1,226 @@
 from Toric_code import *
+from Lattice import get_lattice
+import instrumentation
 import networkx as nx
+import numpy as np
+from collections import defaultdict
 
 
-def calc_path_lengths(grid_s):
-    """TESTED: calculate the path lenghts between the stabilizers which  have an error
+def get_defects(grid_s):
+    """Returns the coords of the stabilizers which have an error
     Input:
             grid_s: LxL grid with errors
     Output:
-            path_lengths: array with for each element:
-             [stabilizer coord 1(tuple), stabilizer coord 2(tuple), path_length]
+            stab_errors: list of stabilizer coords (tuples)
     """
-    # get all stabilizer coords with errors:
-    L = len(grid_s)
     stab_errors = []  # which stabilizer measure the errors
-    path_lengths = []
-
     for row_idx in range(len(grid_s)):
         for col_idx in range(len(grid_s[0])):
             if grid_s[row_idx][col_idx] % 2 == 1:  # we only see the error for 1 or 3 qubit errors
                 stab_errors.append((row_idx, col_idx))
+    return stab_errors
 
+
+def pair_path_lengths(stab_errors, L):
+    """Calculate the path lengths between all pairs of the given stabilizers
+    Input:
+            stab_errors: list of stabilizer coords (tuples)
+            L: grid size
+    Output:
+            path_lengths: array with for each element:
+             [stabilizer coord 1(tuple), stabilizer coord 2(tuple), path_length]
+    """
+    torus_distance = get_lattice(L).torus_distance  # min(|d|, L-|d|)
+    path_lengths = []
     # for each stabilizer pair, calculate the minimum path lenght
     for stab1_idx in range(len(stab_errors) - 1):
         for stab2_idx in range(stab1_idx + 1, len(stab_errors)):
             # we have now that stab1_idx< stab2_idx, so each pair occurs once
             # |row_1-row_2| or L-|row_1-row_2|
-            min_row_dif = min(abs(stab_errors[stab1_idx][0] - stab_errors[stab2_idx][0]),
-                              L - abs(stab_errors[stab1_idx][0] - stab_errors[stab2_idx][0]))
+            min_row_dif = torus_distance[abs(stab_errors[stab1_idx][0] - stab_errors[stab2_idx][0])]
 
             # |col_1-col_2| or L-|col_1-col_2|:
-            min_col_dif = min(abs(stab_errors[stab1_idx][1] - stab_errors[stab2_idx][1]),
-                              L - abs(stab_errors[stab1_idx][1] - stab_errors[stab2_idx][1]))
+            min_col_dif = torus_distance[abs(stab_errors[stab1_idx][1] - stab_errors[stab2_idx][1])]
             path_lengths.append([stab_errors[stab1_idx], stab_errors[stab2_idx], min_row_dif + min_col_dif])
     return path_lengths
 
 
-def matching_to_path(matchings, grid_q):
-    """TESTED(for 1 matching):Add path of matchings to qubit grid
+def calc_path_lengths(grid_s):
+    """TESTED: calculate the path lenghts between the stabilizers which  have an error
+    Input:
+            grid_s: LxL grid with errors
+    Output:
+            path_lengths: array with for each element:
+             [stabilizer coord 1(tuple), stabilizer coord 2(tuple), path_length]
+    """
+    return pair_path_lengths(get_defects(grid_s), len(grid_s))
+
+
+def nearest_path_lengths(stab_errors, L, k):
+    """Calculate the path lengths from each stabilizer to only its k nearest stabilizers on the torus
+    Input:
+            stab_errors: list of stabilizer coords (tuples)
+            L: grid size
+            k: number of nearest neighbours to keep for each stabilizer
+    Output:
+            path_lengths: array with for each element (each pair once):
+             [stabilizer coord 1(tuple), stabilizer coord 2(tuple), path_length]
+    """
+    n = len(stab_errors)
+    if n <= k + 1:  # all pairs are nearest neighbours
+        return pair_path_lengths(stab_errors, L)
+    if n > dense_nearest_limit:
+        return bucket_nearest_path_lengths(stab_errors, L, k)
+    coords = np.array(stab_errors)
+    dif = np.abs(coords[:, None, :] - coords[None, :, :])
+    dist = np.minimum(dif, L - dif).sum(axis=2)
+    np.fill_diagonal(dist, 2 * L + 1)  # never a neighbour of itself
+    nearest = np.argpartition(dist, k, axis=1)[:, :k]
+    pairs = set()
+    for stab1_idx in range(n):
+        for stab2_idx in nearest[stab1_idx]:
+            pairs.add((min(stab1_idx, int(stab2_idx)), max(stab1_idx, int(stab2_idx))))
+    return [[stab_errors[i], stab_errors[j], int(dist[i, j])] for i, j in sorted(pairs)]
+
+
+dense_nearest_limit = 2000  # above this number of stabilizers the nearest ones are found with buckets
+
+
+def bucket_nearest_path_lengths(stab_errors, L, k):
+    """nearest_path_lengths for many stabilizers: the stabilizers are put in square buckets of the torus,
+    and for each stabilizer the rings of buckets around it are searched until the k nearest are certain"""
+    n = len(stab_errors)
+    torus_distance = get_lattice(L).torus_distance
+    size = max(1, int(L * (k / n) ** 0.5))  # about k stabilizers per bucket
+    n_buckets = -(-L // size)  # the last row/column of buckets may be smaller
+    buckets = defaultdict(list)
+    for idx, (row, col) in enumerate(stab_errors):
+        buckets[(row // size, col // size)].append(idx)
+    pairs = {}
+    for idx, (row, col) in enumerate(stab_errors):
+        b_row, b_col = row // size, col // size
+        nearest = []  # (distance, index)
+        searched = set()  # buckets already searched, a ring can wrap around the torus
+        ring = 0
+        while True:
+            for d_row in range(-ring, ring + 1):
+                for d_col in range(-ring, ring + 1):
+                    bucket = ((b_row + d_row) % n_buckets, (b_col + d_col) % n_buckets)
+                    if bucket in searched:
+                        continue
+                    searched.add(bucket)
+                    for other in buckets.get(bucket, ()):
+                        if other != idx:
+                            other_row, other_col = stab_errors[other]
+                            nearest.append((torus_distance[abs(row - other_row)] +
+                                            torus_distance[abs(col - other_col)], other))
+            nearest.sort()
+            del nearest[k:]
+            # stabilizers in the next rings are at least ring*size away, less the part missing in the last bucket
+            if (len(nearest) == k and nearest[-1][0] <= ring * size - (n_buckets * size - L)) \
+                    or 2 * ring + 1 >= n_buckets:
+                break
+            ring += 1
+        for distance, other in nearest:
+            pairs[(min(idx, other), max(idx, other))] = distance
+    return [[stab_errors[i], stab_errors[j], distance] for (i, j), distance in sorted(pairs.items())]
+
+
+def networkx_matching(path_lengths):
+    """Matching backend with the blossom algorithm of networkx
+    Input:
+            path_lengths: array of [stabilizer coord 1, stabilizer coord 2, path_length]
+    Output:
+            matching: set of tuples of two matched stabilizers, of maximum cardinality
+    """
+    G = nx.Graph()
+    for edge in path_lengths:
+        G.add_edge(edge[0], edge[1], weight=-edge[2])
+    return nx.algorithms.matching.max_weight_matching(G, maxcardinality=True)
+
+
+def pymatching_matching(path_lengths):
+    """Matching backend with the sparse blossom algorithm of pymatching (package pymatching needed)
+    Input:
+            path_lengths: array of [stabilizer coord 1, stabilizer coord 2, path_length]
+    Output:
+            matching: list of tuples of two matched stabilizers, a perfect matching
+            raises ValueError if the graph has no perfect matching
+    """
+    import pymatching
+    stabs = []
+    index = {}
+    matching_graph = pymatching.Matching()
+    for stab1, stab2, length in path_lengths:
+        for stab in (stab1, stab2):
+            if stab not in index:
+                index[stab] = len(stabs)
+                stabs.append(stab)
+        matching_graph.add_edge(index[stab1], index[stab2], weight=length, merge_strategy='smallest-weight')
+    if not stabs:
+        return []
+    pairs = matching_graph.decode_to_matched_dets_array(np.ones(len(stabs), dtype=np.uint8))
+    return [(stabs[i], stabs[j]) for i, j in pairs]
+
+
+# matching backends: function(path_lengths) -> matched pairs of stabilizers
+matching_backends = {'networkx': networkx_matching, 'pymatching': pymatching_matching}
+
+
+def register_matching_backend(name, backend):
+    """Add a matching backend, a function which takes path_lengths as made by calc_path_lengths
+    and returns the matched pairs of stabilizers (or raises ValueError if there is no perfect matching)"""
+    matching_backends[name] = backend
+
+
+def decode_MWPM(grid_s, k=None, backend='networkx', counters=None):
+    """Find the minimum weight perfect matching of the stabilizers with an error
+    Input:
+            grid_s: LxL grid with errors
+            k: only use the edges to the k nearest stabilizers of each stabilizer, all pairs if None
+            backend: name of the matching backend in matching_backends
+            counters: instrumentation counters (or None)
+    Output:
+            matching: tuples of two matched stabilizers, for matching_to_path
+    """
+    return decode_MWPM_defects(get_defects(grid_s), len(grid_s), k, backend, counters)
+
+
+def decode_MWPM_defects(stab_errors, L, k=None, backend='networkx', counters=None):
+    """decode_MWPM for the list of coords of the stabilizers with an error, without a stabilizer grid"""
+    match = matching_backends[backend]
+    instrumentation.count(counters, 'defects', len(stab_errors))
+    if k is None:
+        path_lengths = pair_path_lengths(stab_errors, L)
+        instrumentation.count(counters, 'edges', len(path_lengths))
+        return match(path_lengths)
+    try:
+        path_lengths = nearest_path_lengths(stab_errors, L, k)
+        instrumentation.count(counters, 'edges', len(path_lengths))
+        matching = list(match(path_lengths))
+    except ValueError:  # no perfect matching in the sparse graph
+        matching = []
+    # fallback: match the stabilizers which are left over with all pairs between them
+    matched = set()
+    for stab1, stab2 in matching:
+        matched.add(stab1)
+        matched.add(stab2)
+    unmatched = [stab for stab in stab_errors if stab not in matched]
+    if unmatched:
+        instrumentation.count(counters, 'fallback_defects', len(unmatched))
+        matching.extend(match(pair_path_lengths(unmatched, L)))
+    return matching
+
+
+def matching_to_edges(matchings, L):
+    """The edges (qubits) on the paths of the matchings, as edge ids q_row*L+q_col of the qubit grid
     input:
         matchings: array with tuples of two matched stabilizers as elements(stabilizer = tuple of coords)
-        grid_q: grid of qubits with errors before correction
+        L: grid size
     output:
-        grid_q: grid of qubits with all errors(correction=adding errors)
+        edges: list of edge ids, an edge can occur more than once
     """
-    L = len(grid_q[0])
+    edges = []
     for stab1, stab2 in matchings:
         error_path = [0, 0]
         row_dif = abs(stab1[0] - stab2[0])
@@ -61,52 +238,85 @@ def matching_to_path(matchings, grid_q):
             q_col = up_stab[1]  # column of the upper stabilizer
             last_row = down_stab[0]
             if error_path[0]:  # through edge
-                for s_row in range(down_stab[0] - L, up_stab[0]):
-                    q_row = (s_row + 1) * 2  # row under current stabilizer
-                    grid_q[q_row][q_col] += 1  # make error = flip bit
+                s_rows = range(down_stab[0] - L, up_stab[0])
             else:
-                for s_row in range(up_stab[0], down_stab[0]):
-                    q_row = (s_row + 1) * 2  # row under current stabilizer
-                    grid_q[q_row][q_col] += 1
+                s_rows = range(up_stab[0], down_stab[0])
+            for s_row in s_rows:
+                q_row = ((s_row + 1) * 2) % (2 * L)  # row under current stabilizer
+                edges.append(q_row * L + q_col)
 
         if stab1[1] != stab2[1]:  # not the same col
             left_stab = min(stab1, stab2, key=lambda x: x[1])
             right_stab = max(stab1, stab2, key=lambda x: x[1])
             q_row = 2 * last_row + 1
             if error_path[1]:  # through edge
-                for s_col in range(right_stab[1] - L, left_stab[1]):
-                    q_col = s_col + 1  # col right of stabilizer
-                    grid_q[q_row][q_col] += 1  # make error = flip bit
+                s_cols = range(right_stab[1] - L, left_stab[1])
             else:
-                for s_col in range(left_stab[1], right_stab[1]):
-                    q_col = s_col + 1  # col right of stabilizer
-                    grid_q[q_row][q_col] += 1
+                s_cols = range(left_stab[1], right_stab[1])
+            for s_col in s_cols:
+                q_col = (s_col + 1) % L  # col right of stabilizer
+                edges.append(q_row * L + q_col)
+    return edges
+
+
+def matching_to_path(matchings, grid_q):
+    """TESTED(for 1 matching):Add path of matchings to qubit grid
+    input:
+        matchings: array with tuples of two matched stabilizers as elements(stabilizer = tuple of coords)
+        grid_q: grid of qubits with errors before correction
+    output:
+        grid_q: grid of qubits with all errors(correction=adding errors)
+    """
+    L = len(grid_q[0])
+    for edge in matching_to_edges(matchings, L):
+        grid_q[edge // L][edge % L] += 1  # make error = flip bit
     return grid_q
 
-def simulate_MWPM(L,px):
+
+def simulate_MWPM(L, px, k=None, backend='networkx'):
     """Simulate the toric code with the MWPM decoder, and return the result
     Input:
         L: grid size
         px: probability on an X error (0<=px<=1)
+        k: only match to the k nearest stabilizers of each stabilizer, all pairs if None
+        backend: name of the matching backend in matching_backends
     Output:
         True if correction correct
         False if correction gives logical error
     """
+    timer = instrumentation.start('MWPM' if k is None else 'MWPM_sparse', L, px)
     #make the grids and generate the error
     g, q = make_grids(L)
+    timer.stage('make_grids')
     g_errors, q_errors = generate_error(g, q, px)
+    timer.stage('generate_error')
 
-    # get the graph from the stabilizer grid
-    path_lengths = calc_path_lengths(g_errors)
-    G = nx.Graph()
-    for edge in path_lengths:
-        G.add_edge(edge[0], edge[1], weight=-edge[2])
     # decode
-    matching = nx.algorithms.matching.max_weight_matching(G, maxcardinality=True)
+    matching = decode_MWPM(g_errors, k, backend, timer.counters)
+    timer.stage('decode')
     matched_error_grid = matching_to_path(matching, q_errors)
+    timer.stage('correct')
 
     # check if decoding worked
     check = check_correction(matched_error_grid)
+    timer.stage('check')
     return check[0]
 
 
+sparse_k = 8  # nearest stabilizers kept per stabilizer by simulate_MWPM_sparse
+sparse_backend = 'networkx'  # matching backend of simulate_MWPM_sparse
+
+
+def simulate_MWPM_sparse(L, px):
+    """simulate_MWPM with the sparse graph of the sparse_k nearest stabilizers and the sparse_backend"""
+    return simulate_MWPM(L, px, k=sparse_k, backend=sparse_backend)
+
+
+def correct_MWPM(L, grid_s, grid_q, erasure):
+    """Decode a given error with the MWPM decoder, True if the correction is correct"""
+    return check_correction(matching_to_path(decode_MWPM(grid_s), grid_q))[0]
+
+
+def correct_MWPM_sparse(L, grid_s, grid_q, erasure):
+    """correct_MWPM with the sparse graph and the matching backend of simulate_MWPM_sparse"""
+    return check_correction(matching_to_path(decode_MWPM(grid_s, sparse_k, sparse_backend), grid_q))[0]
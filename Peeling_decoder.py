@@ -1,40 +1,32 @@
 from collections import defaultdict
 from random import random
 from Toric_code import *
+from Lattice import get_lattice
+import instrumentation
+import numpy as np
 
 
 def peeling_decoder(erasure, syndrome):
     """(TESTED) Given an erasure and syndrome, construct a Pauli Z error P
     such that P is a subset of the erasure and such that the syndrome of P equals the syndrome
-    1) construct spanning forest F
+    1) construct spanning forest F, remembering for each vertex the edge to its parent
     2) initialize A (empty set/list)
-    3) while F nonempty: pick leaf e = {u,v}. u at the outside
-        -remove e from F
-        - if u in syndrome: add e to A, remove u from syndrome, flip v in syndrome
-        -else: do nothing
-    return P = Z errors on all edges in A"""
+    3) for all vertices u in reversed order of discovery (leaves first), e = {u, parent of u}:
+        - if u in syndrome: add e to A, remove u from syndrome, flip parent in syndrome
+        - else: do nothing
+    return P = Z errors on all edges in A
+    Runs without recursion in one linear pass, so also for very large erasures"""
     # syndrome is defaultdict(int)
-    F = spanning_forest_dict(erasure)
+    order, parent_edge = spanning_forest_order(erasure)
     A = []
-    vertex_count = defaultdict(int)
-    for el in F:
-        vertex_count[el[0]] += 1
-        vertex_count[el[1]] += 1
-
-    while F:
-        leaf_edge = F.pop()
-        if vertex_count[leaf_edge[0]] == 0:
-            u = leaf_edge[0]
-            v = leaf_edge[1]
-        else:
-            u = leaf_edge[1]
-            v = leaf_edge[0]
-
-        vertex_count[u] -= 1
-        vertex_count[v] -= 1
+    for u in reversed(order):  # children are always found after their parent
+        edge = parent_edge.get(u)
+        if edge is None:  # root of a tree
+            continue
         if syndrome[u] == 1:
-            A.append(leaf_edge)
-            syndrome[u] -= 1  # not necessary? # can be used to check at the end
+            A.append(edge)
+            syndrome[u] -= 1  # can be used to check at the end
+            v = edge[0]
             if syndrome[v] == 1:
                 syndrome[v] -= 1
             else:
@@ -42,6 +34,17 @@ def peeling_decoder(erasure, syndrome):
     return A
 
 
+def peeling_decoder_batch(erasures, syndromes):
+    """Apply the peeling decoder to many erasures at once, as made by make_erasure_batch
+    Input:
+        erasures: (shots, 2L, L) bool array, True for an erased qubit
+        syndromes: (shots, L, L) array, 1 for a stabilizer with -1 as outcome
+    Output:
+        corrections: list with for each shot the edges which need to be corrected"""
+    return [peeling_decoder(erasure_mask_to_edges(erasure), syndrome_to_dict(syndrome))
+            for erasure, syndrome in zip(erasures, syndromes)]
+
+
 def edge_list_to_graph(e):
     """Creates a graph in the form of adjacency lists from an edge list
     Input:  e:      list of all edges of the graph
@@ -54,19 +57,25 @@ def edge_list_to_graph(e):
 
 
 def spanning_tree_dict(graph, visited, tree, vertex):
-    """Creates a spanning tree of the connected component of vertex in the graph
+    """Creates a spanning tree of the connected component of vertex in the graph, depth first with an explicit stack
     Input:  graph: dict with vertices as keys, for each vertex the value is a list of neighbouring vertices
             visited: dict with vertices as keys, 0 or 1 as value. 0 =  not visited, 1 = visited
             tree: the tree which is being build
-            vertex: the current vertex from where the tree is built further
+            vertex: the vertex from where the tree is built
     Output: tree: the final spanning tree
-            visited: dict with vertices as keys, 0 or 1 as value. 0 =  not visited, 1 = visited. Not useful but needed for recursion"""
+            visited: dict with vertices as keys, 0 or 1 as value. 0 =  not visited, 1 = visited"""
     visited[vertex] = 1
-
-    for neighbour in graph[vertex]:
-        if not visited[neighbour]:
-            tree.append((vertex, neighbour))
-            tree, visited = spanning_tree_dict(graph, visited, tree, neighbour)
+    stack = [(vertex, iter(graph[vertex]))]
+    while stack:
+        current, neighbours = stack[-1]
+        for neighbour in neighbours:
+            if not visited[neighbour]:
+                visited[neighbour] = 1
+                tree.append((current, neighbour))
+                stack.append((neighbour, iter(graph[neighbour])))
+                break
+        else:  # all neighbours visited
+            stack.pop()
     return tree, visited
 
 
@@ -87,6 +96,34 @@ def spanning_forest_dict(graph):
     return tree
 
 
+def spanning_forest_order(graph):
+    """Creates a spanning forest of the graph without recursion, for the peeling decoder
+    Input:  graph: dict with vertices as keys, for each vertex the value is a list of neighbouring vertices
+                    or an edge list (list of all edges in the graph)
+    Output: order: all vertices in the order they are found, a parent is always before its children
+            parent_edge: dict with for each vertex which is not a root the edge (parent, vertex) of the forest"""
+    if type(graph) != dict:
+        # assume its an edge list
+        graph = edge_list_to_graph(graph)
+    order = []
+    parent_edge = {}
+    visited = set()
+    for root in graph:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [root]
+        while stack:
+            v = stack.pop()
+            order.append(v)
+            for neighbour in graph[v]:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    parent_edge[neighbour] = (v, neighbour)
+                    stack.append(neighbour)
+    return order, parent_edge
+
+
 def make_erasure(grid_s, grid_q, p_e):
     """"Make an erasure on grid_q, and add the syndrome to grid_s. Erasure with probability p_e,
     if a qubit is erased, 50% chance on X/Y error(detectable)
@@ -99,30 +136,62 @@ def make_erasure(grid_s, grid_q, p_e):
         grid_s: stabilizer grid with errors added
         grid_q: qubit grid with errors added
         """
+    edge_stabs = get_lattice(len(grid_q[0])).edge_stabs
     erasures = []
     for row_idx in range(len(grid_q)):
         for col_idx in range(len(grid_q[0])):
             error = random() <= p_e
             if error:
-                if row_idx % 2 == 0:
-                    # above/under stabilizers -> same column
-                    stab_row = int(row_idx / 2) % len(grid_s)
-                    erasures.append(((stab_row, col_idx), ((stab_row - 1) % len(grid_s), col_idx)))
-                    if random() <= 0.5:  # 50% chance on Y or Z error
-                        grid_s[stab_row][col_idx] += 1  # stabilizer under qubit
-                        grid_s[(stab_row - 1) % len(grid_s)][col_idx] += 1  # stabilizer above qubit
-                        grid_q[row_idx][col_idx] += 1
-                else:
-                    # left/right of stabilizers -> same row
-                    stab_row = int((row_idx - 1) / 2) % len(grid_s)
-                    erasures.append(((stab_row, col_idx), (stab_row, (col_idx - 1) % len(grid_s[0]))))
-                    if random() <= 0.5:  # 50% chance on Y or Z error
-                        grid_s[stab_row][col_idx] += 1  # stabilizer right of qubit
-                        grid_s[stab_row][(col_idx - 1) % len(grid_s[0])] += 1  # stabilizer right of qubit
-                        grid_q[row_idx][col_idx] += 1
+                # the two stabilizers next to the qubit
+                stab1, stab2 = edge_stabs[row_idx * len(grid_q[0]) + col_idx]
+                erasures.append((stab1, stab2))
+                if random() <= 0.5:  # 50% chance on Y or Z error
+                    grid_s[stab1[0]][stab1[1]] += 1
+                    grid_s[stab2[0]][stab2[1]] += 1
+                    grid_q[row_idx][col_idx] += 1
     return erasures, grid_s, grid_q
 
 
+def make_erasure_batch(L, p_e, shots, rng=None):
+    """Make erasures for many shots at once, batched version of make_erasure.
+    Each qubit is erased with probability p_e, an erased qubit gets an X/Y error with 50% chance
+    Input:
+        L: size of grid
+        p_e: probability on erasure
+        shots: number of grids to generate
+        rng: numpy Generator or seed to draw from (fresh generator if None)
+    Output:
+        erasures: (shots, 2L, L) bool array, True for an erased qubit
+        errors: (shots, 2L, L) uint8 array of qubit grids with errors added
+        syndromes: (shots, L, L) uint8 array of stabilizer grids, 1 for a stabilizer with -1 as outcome
+    """
+    rng = np.random.default_rng(rng)
+    erasures = rng.random((shots, 2 * L, L)) <= p_e
+    errors = (erasures & (rng.random((shots, 2 * L, L)) <= 0.5)).astype(np.uint8)
+    return erasures, errors, syndrome_batch(errors)
+
+
+def erasure_mask_to_edges(erasure):
+    """Convert one (2L, L) erasure mask from make_erasure_batch to the edge list of make_erasure
+    Input:
+        erasure: (2L, L) bool array, True for an erased qubit
+    Output:
+        erasures: the qubits which are erased (between which stabs)
+    """
+    edge_stabs = get_lattice(len(erasure[0])).edge_stabs
+    return [edge_stabs[e] for e in np.flatnonzero(erasure)]
+
+
+def syndrome_to_dict(syndrome):
+    """Convert one (L, L) syndrome array from a batch to the syndrome dict of get_syndrome
+    Input: syndrome: (L, L) array, 1 for a stabilizer with -1 as outcome
+    Output: syndrome_res: dict with 1 as value for the coords of the stabilizers with -1 as outcome"""
+    syndrome_res = defaultdict(int)
+    for row_idx, col_idx in zip(*np.nonzero(syndrome)):
+        syndrome_res[(int(row_idx), int(col_idx))] = 1
+    return syndrome_res
+
+
 def get_syndrome(grid_s):
     """Determines the syndrome based on grid_s
     Input: grid_s: stabilizer grid of which the syndrome should be determined
@@ -143,23 +212,9 @@ def apply_peeling_correction(grid_q, correction):
     Output:
         grid_q: corrected qubit grid
     """
+    lattice = get_lattice(len(grid_q[0]))
     for bit in correction:
-        if bit[0][0] == bit[1][0]:  # same row
-            row = bit[0][0] * 2 + 1
-            left_col = min(bit[0][1], bit[1][1])
-            right_col = max(bit[0][1], bit[1][1])
-            if right_col - left_col > 1:  # edge case
-                col = 0
-            else:
-                col = right_col
-        else:  # same col
-            col = bit[0][1]
-            up_row = min(bit[0][0], bit[1][0])
-            low_row = max(bit[0][0], bit[1][0])
-            if low_row - up_row > 1:  # edge case
-                row = 0
-            else:
-                row = low_row * 2
+        row, col = lattice.qubit(bit[0], bit[1])
         grid_q[row][col] += 1
     return grid_q
 
@@ -173,15 +228,31 @@ def simulate_peeling(L, pe):
         True if correction correct
         False if correction gives logical error
     """
+    timer = instrumentation.start('peeling', L, pe)
     # make grids, generate erasure error and get the syndrome
     g, q = make_grids(L)
+    timer.stage('make_grids')
     erasure, error_g, error_q = make_erasure(g, q, pe)
+    timer.stage('generate_error')
     syndrome = get_syndrome(error_g)
+    timer.stage('get_syndrome')
 
     # apply the peeling decoder
     correction = peeling_decoder(erasure, syndrome)
+    timer.stage('decode')
+    if timer.counters is not None:
+        timer.counters['erased_edges'] += len(erasure)
+        timer.counters['correction_edges'] += len(correction)
     corrected_grid = apply_peeling_correction(error_q, correction)
+    timer.stage('correct')
 
     # check if the correction is correct
     check = check_correction(corrected_grid)
+    timer.stage('check')
     return check[0]
+
+
+def correct_peeling(L, grid_s, grid_q, erasure):
+    """Decode a given erasure with the peeling decoder, True if the correction is correct"""
+    correction = peeling_decoder(erasure, get_syndrome(grid_s))
+    return check_correction(apply_peeling_correction(grid_q, correction))[0]
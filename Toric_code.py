@@ -1,6 +1,8 @@
 # The basis to simulate the toric code: generate grids, simulate errors, check if correction is complete etc
 
 from random import random
+import numpy as np
+from Lattice import get_lattice
 
 
 def make_grids(L):
@@ -49,23 +51,20 @@ def generate_error(grid_s, grid_q, px):
                 on neighbouring qubits
             grid_q: 2LxL grid of qubits, with values 0-1 for 0 or 1 error on the qubits
             """
+    edge_stabs = get_lattice(len(grid_q[0])).edge_stabs
     # loop through all qubits:
+    edge = 0
     for row_idx in range(len(grid_q)):
         for col_idx in range(len(grid_q[0])):
             error = random() <= px
+            edge += 1
             if not error:
                 # nothing has to be changed
                 continue
-            if row_idx % 2 == 0:
-                # above/under stabilizers -> same column
-                stab_row = int(row_idx / 2)
-                grid_s[stab_row][col_idx] += 1  # stabilizer under qubit
-                grid_s[stab_row - 1][col_idx] += 1  # stabilizer above qubit
-            else:
-                # left/right of stabilizers -> same row
-                stab_row = int((row_idx - 1) / 2)
-                grid_s[stab_row][col_idx] += 1  # stabilizer right of qubit
-                grid_s[stab_row][col_idx - 1] += 1  # stabilizer right of qubit
+            # the two stabilizers next to the qubit
+            stab1, stab2 = edge_stabs[edge - 1]
+            grid_s[stab1[0]][stab1[1]] += 1
+            grid_s[stab2[0]][stab2[1]] += 1
             grid_q[row_idx][col_idx] += 1
     return grid_s, grid_q
 
@@ -82,7 +81,7 @@ def check_correction(grid_q):
     if sum(grid_q[0]) % 2 == 1:
         return (False, 'X1')
     # odd rows = X2
-    if sum([grid_q[x][0] for x in range(1, len(grid_q), 2)]) == 1:
+    if sum([grid_q[x][0] for x in range(1, len(grid_q), 2)]) % 2 == 1:
         return (False, 'X2')
 
     # and if all stabilizers give outcome +1 => even number of qubit flips for each stabilizer
@@ -105,4 +104,50 @@ def check_correction(grid_q):
 
     return (True, 'end')
     # other way of checking: for each row, look if no errors on qubits, => no loop around torus,so no gate applied.
-    # and similar for columns
\ No newline at end of file
+    # and similar for columns
+
+
+def syndrome_batch(errors):
+    """Compute the stabilizer outcomes of a batch of qubit grids, with vectorized rolls on the torus
+    Input:
+        errors: (shots, 2L, L) array of qubit grids, only the parity of each value counts
+    Output:
+        syndromes: (shots, L, L) uint8 array, 1 for a stabilizer with -1 as outcome
+    """
+    errors = np.asarray(errors, dtype=np.uint8) & 1
+    above = errors[:, 0::2]  # qubits above the stabilizers (even rows)
+    left = errors[:, 1::2]  # qubits left of the stabilizers (odd rows)
+    # the qubit under a stabilizer is above the next row, the qubit right of it is left of the next column
+    return above ^ np.roll(above, -1, axis=1) ^ left ^ np.roll(left, -1, axis=2)
+
+
+def generate_error_batch(L, px, shots, rng=None):
+    """Generate random errors for many shots at once, batched version of generate_error
+    Input:
+        L: size of grid
+        px: probability to have an error on a qubit
+        shots: number of grids to generate
+        rng: numpy Generator or seed to draw from (fresh generator if None)
+    Output:
+        errors: (shots, 2L, L) uint8 array of qubit grids, 1 for an error on the qubit
+        syndromes: (shots, L, L) uint8 array of stabilizer grids, 1 for a stabilizer with -1 as outcome
+    """
+    rng = np.random.default_rng(rng)
+    errors = (rng.random((shots, 2 * L, L)) <= px).astype(np.uint8)
+    return errors, syndrome_batch(errors)
+
+
+def check_correction_batch(grids_q):
+    """Check a batch of corrected qubit grids, batched version of check_correction
+    input:
+        grids_q: (shots, 2L, L) array of qubit grids with errors and corrections
+    output:
+        x1: bool array, True if the shot has an odd number of logical X1 (parity of the upper row)
+        x2: bool array, True if the shot has an odd number of logical X2 (parity of the first column of odd rows)
+        stab: bool array, True if any stabilizer still gives -1 as outcome
+    """
+    grids_q = np.asarray(grids_q, dtype=np.uint8) & 1
+    x1 = np.bitwise_xor.reduce(grids_q[:, 0, :], axis=1).astype(bool)
+    x2 = np.bitwise_xor.reduce(grids_q[:, 1::2, 0], axis=1).astype(bool)
+    stab = syndrome_batch(grids_q).any(axis=(1, 2))
+    return x1, x2, stab
@@ -0,0 +1,207 @@
+from Peeling_decoder import peeling_decoder, get_syndrome, apply_peeling_correction
+from Toric_code import make_grids, generate_error, check_correction
+from Lattice import get_lattice
+import instrumentation
+from UF_decoder import GrowQueue
+from collections import defaultdict
+
+
+class ArrayUFDecoder:
+    """Union-Find decoder with all state in flat preallocated lists, indexed by integer ids.
+    Vertex (stabilizer) (row, col) has id row*L+col, edge (qubit) (q_row, q_col) of the 2LxL qubit grid
+    has id q_row*L+q_col. One decoder can be reused for all shots with the same L: only the entries
+    touched by a decode are reset afterwards."""
+
+    def __init__(self, L):
+        """Allocate the state for gridsize L, the lattice tables are shared with the other decoders"""
+        self.L = L
+        self.lattice = get_lattice(L)
+        self.parent = list(range(L * L))
+        self.size = [1] * (L * L)
+        self.parity = [0] * (L * L)
+        self.boundary = [None] * (L * L)  # boundary vertices as dict keys (an ordered set), only for roots of clusters
+        self.support = [0] * (2 * L * L)  # 0 = unoccupied, 1 = half grown, 2 = grown
+
+    def find(self, v):
+        """Returns the root of the cluster of vertex v, with path halving"""
+        parent = self.parent
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    def find_counted(self, v, counters):
+        """find, also adding the call and the length of the path to the root to the counters"""
+        counters['find_calls'] += 1
+        x = v
+        while self.parent[x] != x:
+            counters['find_path_length'] += 1
+            x = self.parent[x]
+        return self.find(v)
+
+    def decode(self, syndrome, counters=None):
+        """Grow and merge clusters from the syndrome and peel the grown edges
+        Input:
+            syndrome: the syndrome of an error, coords of the stabilizers with -1 as outcome (like get_syndrome)
+            counters: instrumentation counters (or None)
+        Output:
+            the edges which need to be corrected, as (stab1, stab2) for apply_peeling_correction"""
+        L = self.L
+        edge_stabs = self.lattice.edge_stabs
+        erasure = [edge_stabs[e] for e in self.grow_clusters([row * L + col for row, col in syndrome], counters)]
+        peel_syndrome = defaultdict(int)
+        for g in syndrome:
+            peel_syndrome[g] = 1
+        return peeling_decoder(erasure, peel_syndrome)
+
+    def decode_edges(self, defects, counters=None):
+        """decode with only ids, without the coordinate tables, for the sparse pipeline of sparse_errors
+        Input:
+            defects: ids of the vertices with -1 as outcome
+            counters: instrumentation counters (or None)
+        Output:
+            ids of the edges which need to be corrected"""
+        edge_u, edge_v = self.lattice.edge_u, self.lattice.edge_v
+        erasure = [(edge_u[e], edge_v[e]) for e in self.grow_clusters(defects, counters)]
+        peel_syndrome = defaultdict(int)
+        for v in defects:
+            peel_syndrome[v] = 1
+        return [self.lattice.edge_between(u, v) for u, v in peeling_decoder(erasure, peel_syndrome)]
+
+    def grow_clusters(self, defects, counters=None):
+        """Grow and merge clusters from the defects until all clusters have even parity
+        Input:
+            defects: ids of the vertices with -1 as outcome
+            counters: instrumentation counters (or None)
+        Output:
+            ids of the grown edges, the erasure for the peeling decoder"""
+        parent, size, parity = self.parent, self.size, self.parity
+        boundary, support = self.boundary, self.support
+        edges, edge_u, edge_v = self.lattice.vertex_edges, self.lattice.edge_u, self.lattice.edge_v
+        if counters is None:
+            find = self.find
+        else:
+            def find(v):
+                return self.find_counted(v, counters)
+        touched_vertices = []
+        touched_edges = []
+        grow_order = GrowQueue()  # clusters by boundary size, in order of entry for the same size
+        for v in defects:
+            parity[v] = 1
+            boundary[v] = {v: None}
+            touched_vertices.append(v)
+            grow_order.push(1, v)
+
+        while grow_order:
+            boundary_size, root = grow_order.pop()
+            # skip stale entries: merged into another cluster, boundary changed or even parity
+            if parent[root] != root or len(boundary[root]) != boundary_size or parity[root] == 0:
+                instrumentation.count(counters, 'stale_skips')
+                continue
+
+            # growth
+            fusion_edges = []
+            for v in boundary[root]:
+                for e in edges[4 * v:4 * v + 4]:
+                    if support[e] == 0:
+                        support[e] = 1
+                        touched_edges.append(e)
+                    elif support[e] == 1:
+                        support[e] = 2
+                        fusion_edges.append(e)
+
+            if counters is not None:
+                counters['growth_rounds'] += 1
+                counters['fusion_edges'] += len(fusion_edges)
+
+            # fusion, union by size
+            changed_roots = [root]
+            for e in fusion_edges:
+                x = find(edge_u[e])
+                y = find(edge_v[e])
+                if x == y:
+                    continue
+                if size[x] < size[y] or boundary[x] is None:
+                    x, y = y, x  # y is smallest cluster, or a single vertex
+                instrumentation.count(counters, 'merges')
+                parent[y] = x
+                size[x] += size[y]
+                parity[x] ^= parity[y]
+                if boundary[y] is None:  # y is a single vertex, no real cluster yet
+                    boundary[x][y] = None
+                else:  # add the smallest boundary to the largest
+                    if len(boundary[x]) < len(boundary[y]):
+                        boundary[x], boundary[y] = boundary[y], boundary[x]
+                    boundary[x].update(boundary[y])
+                    boundary[y] = None
+                touched_vertices.append(y)
+                touched_vertices.append(x)
+                changed_roots.append(x)
+
+            # update boundary lists of the odd clusters and add them to the grow order
+            for x in set(changed_roots):
+                if parent[x] != x or parity[x] == 0:
+                    continue
+                inner = [v for v in boundary[x]
+                         if support[edges[4 * v]] == 2 and support[edges[4 * v + 1]] == 2 and
+                         support[edges[4 * v + 2]] == 2 and support[edges[4 * v + 3]] == 2]
+                for v in inner:
+                    del boundary[x][v]
+                grow_order.push(len(boundary[x]), x)
+
+        if counters is not None:  # the clusters after growth, each with its own root
+            counters['clusters'] += len({self.find(v) for v in defects})
+        erasure = [e for e in touched_edges if support[e] == 2]
+
+        # reset the touched state for the next decode
+        for v in touched_vertices:
+            parent[v] = v
+            size[v] = 1
+            parity[v] = 0
+            boundary[v] = None
+        for e in touched_edges:
+            support[e] = 0
+        return erasure
+
+
+decoders = {}  # ArrayUFDecoder per gridsize, reused by simulate_UF_array
+
+
+def get_decoder(L):
+    """Returns the ArrayUFDecoder for gridsize L, made on first use"""
+    if L not in decoders:
+        decoders[L] = ArrayUFDecoder(L)
+    return decoders[L]
+
+
+def simulate_UF_array(L, px):
+    """Simulate the toric code with the array-backed UF decoder.
+    Input:
+        L: gridsize
+        px: the probability on an error
+    Output:
+        True if the correction is correct
+        False if the correction gives a logical error"""
+    timer = instrumentation.start('UF_array', L, px)
+    # make the grids, generate the error and get the syndrome
+    grid_g, grid_q = make_grids(L)
+    timer.stage('make_grids')
+    g_errors, q_errors = generate_error(grid_g, grid_q, px)
+    timer.stage('generate_error')
+    syndrome = get_syndrome(g_errors)
+    timer.stage('get_syndrome')
+    # apply the decoder
+    correction = get_decoder(L).decode(syndrome, timer.counters)
+    timer.stage('decode')
+    grid_corrected = apply_peeling_correction(q_errors, correction)
+    timer.stage('correct')
+
+    correct = check_correction(grid_corrected)
+    timer.stage('check')
+    return correct[0]
+
+
+def correct_UF_array(L, grid_s, grid_q, erasure):
+    """Decode a given error with the ArrayUFDecoder of gridsize L, True if the correction is correct"""
+    correction = get_decoder(L).decode(get_syndrome(grid_s))
+    return check_correction(apply_peeling_correction(grid_q, correction))[0]
@@ -1,7 +1,9 @@
 from Peeling_decoder import peeling_decoder, get_syndrome, \
     apply_peeling_correction, print_grid_stab, print_grid_qubits
 from Toric_code import make_grids, generate_error, check_correction
-from collections import defaultdict
+from Lattice import get_lattice
+import instrumentation
+from collections import defaultdict, deque
 import heapq
 
 
@@ -20,6 +22,16 @@ def find(el, clusters):  # path splitting
     return el
 
 
+def find_counted(el, clusters, counters):
+    """find, also adding the call and the length of the path to the root to the counters"""
+    counters['find_calls'] += 1
+    x = el
+    while clusters[x][0] != 0 and clusters[x][0] != x:
+        counters['find_path_length'] += 1
+        x = clusters[x][0]
+    return find(el, clusters)
+
+
 def union(x, y, clusters):  # by size
     """Merges clusters of x and y
     Input:  x,y : roots of clusters which must be merged
@@ -35,21 +47,51 @@ def union(x, y, clusters):  # by size
     clusters[x][2] += clusters[y][2]  # update parity
 
 
-def grow(cluster_roots, boundaries, support, clusters,L):
+class GrowQueue:
+    """Bucket queue of the clusters to grow, keyed by boundary size. pop returns the root with the smallest
+    boundary, of those the first one added. Each size has a deque of roots, a heap only holds the sizes which
+    have a bucket, so adding and popping a root is O(1) apart from the few distinct sizes."""
+
+    def __init__(self):
+        self.buckets = {}  # boundary size -> deque of roots
+        self.sizes = []  # heap of the keys of buckets
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def push(self, size, root):
+        if size not in self.buckets:
+            self.buckets[size] = deque()
+            heapq.heappush(self.sizes, size)
+        self.buckets[size].append(root)
+
+    def pop(self):
+        """Returns (size, root) of the first root with the smallest boundary size"""
+        size = self.sizes[0]
+        bucket = self.buckets[size]
+        root = bucket.popleft()
+        if not bucket:
+            del self.buckets[size]
+            heapq.heappop(self.sizes)
+        return size, root
+
+
+def grow(cluster_roots, boundaries, support, clusters,L, counters=None):
     """Grows the clusters, merges the touching clusters.
     Input:  cluster_roots:  list of roots of the clusters which must be grown
-            boundaries:     dict with the boundary vertices for each cluster_root
-            support:        dict with edges as keys, 0, 1 or 2 as value (not grown, half grown, fully grown)
+            boundaries:     dict with the boundary vertices for each cluster_root, as dict keys (an ordered set)
+            support:        dict with edge ids as keys, 0, 1 or 2 as value (not grown, half grown, fully grown)
             clusters:       dict where all elements link to their parents
+            counters:       instrumentation counters (or None)
     Output: final_roots:    list of the roots of the odd clusters which have been changed (grown/merged)"""
+    lattice = get_lattice(L)
+    vertex_edges = lattice.vertex_edges  # the 4 edges of each vertex
     # growth
-    next_nodes = [(1, 0), (0, 1), (-1, 0), (0, -1)]  # where to go for the neighbouring nodes
     fusion_edges = []
     for u in cluster_roots:  # loop over all given roots
         for v in boundaries[u]:  # each boundary vertex
-            for n in next_nodes:  # each possible neighbouring vertex
-                other = ((v[0] + n[0]) % L, (v[1] + n[1]) % L)  # define neighbouring vertex
-                edge = (min(v, other), max(v, other))  # define edge from boundary vertex to neighbouring vertex
+            v_id = v[0] * L + v[1]
+            for edge in vertex_edges[4 * v_id:4 * v_id + 4]:  # each edge to a neighbouring vertex
                 if support[edge] == 0:  # grow edge
                     support[edge] += 1
                 elif support[edge] == 1:
@@ -57,24 +99,35 @@ def grow(cluster_roots, boundaries, support, clusters,L):
                     fusion_edges.append(edge)  # if fully grown: possible merge of clusters
 
     # print('fusion_edges', fusion_edges)
+    if counters is not None:
+        counters['growth_rounds'] += 1
+        counters['fusion_edges'] += len(fusion_edges)
 
     # fusion of clusters + fusion of boundary lists + updating roots
     new_roots = defaultdict(int)
     found_roots = defaultdict(int)  # to see which roots we've already seen
     while len(fusion_edges) > 0:  # loop over all fusion edges
-        u, v = fusion_edges.pop()  # ensure that the loop will terminate
+        u, v = lattice.edge_stabs[fusion_edges.pop()]  # ensure that the loop will terminate
         # print(u, v)
-        u_root = find(u, clusters)
-        v_root = find(v, clusters)
+        if counters is None:
+            u_root = find(u, clusters)
+            v_root = find(v, clusters)
+        else:
+            u_root = find_counted(u, clusters, counters)
+            v_root = find_counted(v, clusters, counters)
         if u_root != v_root:
             found_roots[u_root] += 1  # first check if they are not of the same cluster, then add to found roots.
             found_roots[v_root] += 1
             if clusters[u_root][1] < clusters[v_root][1]:
                 u_root, v_root = v_root, u_root  # smallest is v_root
             if len(boundaries[v_root]) == 0:  # v_root is a single generator, no real cluster
-                boundaries[u_root].append(v_root)
-            else:
-                boundaries[u_root].extend(boundaries[v_root])  # v_root has a cluster
+                boundaries[u_root][v_root] = None
+            else:  # v_root has a cluster, add the smallest boundary to the largest
+                if len(boundaries[u_root]) < len(boundaries[v_root]):
+                    boundaries[u_root], boundaries[v_root] = boundaries[v_root], boundaries[u_root]
+                boundaries[u_root].update(boundaries[v_root])
+                del boundaries[v_root]
+            instrumentation.count(counters, 'merges')
             union(u_root, v_root,
                   clusters)  # merge u and v #distinct clusters, thus no need to check in function anymore (2x less find(u) each time)
             if new_roots[
@@ -90,14 +143,17 @@ def grow(cluster_roots, boundaries, support, clusters,L):
 
     # update boundary lists
     for u in new_roots:  # loop over keys (= roots)
-        for v in boundaries[u]:  # for each boundary vertex
-            for n in next_nodes:  # if all incident edges are fully grown, remove v from boundary
-                other = ((v[0] + n[0]) % L, (v[1] + n[1]) % L)
-                edge = (min(v, other), max(v, other))
+        boundary = boundaries[u]
+        inner = []
+        for v in boundary:  # for each boundary vertex
+            v_id = v[0] * L + v[1]
+            for edge in vertex_edges[4 * v_id:4 * v_id + 4]:  # if all incident edges are fully grown, remove v from boundary
                 if not support[edge] == 2:
                     break
             else:
-                boundaries[u].remove(v)
+                inner.append(v)
+        for v in inner:
+            del boundary[v]
 
     for x in cluster_roots:  # add original root if not merged
         if not found_roots[x]:
@@ -107,51 +163,61 @@ def grow(cluster_roots, boundaries, support, clusters,L):
     return final_roots
 
 
-def union_find_decoder(syndrome,L):
-    """Initializes all data structures and runs the algorithm
+def grow_clusters(syndrome, L, counters=None, interior=None):
+    """Grows and merges the clusters of the syndrome until all clusters have even parity
     Input:
-        syndrome: the syndrome of an error
+        syndrome: the coords of the stabilizers with -1 as outcome (the keys of the syndrome dict), in this order
+        counters: instrumentation counters (or None)
+        interior: set of the vertices from which clusters may grow (None = all), a cluster with a boundary vertex
+            outside it is not grown anymore, so the clusters stay in a region (used by parallel_decoder)
     Output:
-        the edges which need to be corrected"""
-    support = defaultdict(int)  # 0 = unoccupied, 1 = half grown from node, 2 = grown
-    boundaries = defaultdict(list)
+        support: dict edge id -> 1 (half grown) or 2 (grown), in the order the edges were reached
+        clusters: dict where all vertices of the clusters link to their parents"""
+    support = defaultdict(int)  # edge id -> 0 = unoccupied, 1 = half grown from node, 2 = grown
+    boundaries = defaultdict(dict)  # root -> boundary vertices as keys, O(1) removal
     clusters = defaultdict(lambda: [0, 1, 0])
     cluster_roots = []
-    grow_order = []
-    entry_num = 1
+    grow_order = GrowQueue()  # clusters by boundary size, in order of entry for the same size
     for g in syndrome:
         clusters[g][0] = g  # generator with syndrome
         clusters[g][2] = 1  # parity
         cluster_roots.append(g)  # make g a cluster root
-        boundaries[g] = [g]  # boundaries of g
-        heapq.heappush(grow_order, [1, entry_num, g])  # add g to the grow order, as parity is odd
-        entry_num += 1  # picks lowest in order of entry -> do not grow the same cluster two times in a row if more clusters ¿of same size
+        boundaries[g] = {g: None}  # boundaries of g
+        if interior is None or g in interior:
+            grow_order.push(1, g)  # add g to the grow order, as parity is odd
     while grow_order:  # until there are no elements to grow
-        grow_root = heapq.heappop(grow_order)  # get element with smallest size
-        if clusters[grow_root[2]][0] != grow_root[2]:  # not a root anymore, so skip to the next root in grow order
-            # print('not a root', grow_root)
+        size, root = grow_order.pop()  # get element with smallest size
+        if clusters[root][0] != root:  # not a root anymore, so skip to the next root in grow order
+            instrumentation.count(counters, 'stale_skips')
             continue
-        if len(boundaries[grow_root[2]]) != grow_root[0]:  # boundary has grown, so not smallest anymore
-            # print('larger boundary',grow_root)
+        if len(boundaries[root]) != size:  # boundary has changed since it was added, a newer entry is in the queue
+            instrumentation.count(counters, 'stale_skips')
             continue
-        if clusters[grow_root[2]][2] % 2 == 0:  # don't grow if parity is even
-            # print('even parity',grow_root)
+        if clusters[root][2] % 2 == 0:  # don't grow if parity is even
             continue
 
-        # print('old', grow_root)
-        # print('boundary', boundaries[grow_root[1]])
-        new_odd_cluster_roots = grow([grow_root[2]], boundaries, support, clusters,L)  # grow smallest cluster
-        # print('new:', new_odd_cluster_roots)
-        if len(new_odd_cluster_roots) > 0:  # if there are roots to add, add element to grow_order
-            for el in new_odd_cluster_roots:
-                heapq.heappush(grow_order, [len(boundaries[el]), entry_num,
-                                            el])  # possible problem: duplicates. Thus no longer in right order. Fixed by checking at start of loop
-                entry_num += 1
-        # print('order:', grow_order)
+        new_odd_cluster_roots = grow([root], boundaries, support, clusters, L, counters)  # grow smallest cluster
+        for el in new_odd_cluster_roots:  # add the changed odd clusters to the grow order again
+            if interior is None or all(v in interior for v in boundaries[el]):
+                grow_order.push(len(boundaries[el]), el)
+    if counters is not None:  # the clusters after growth, each with its own root
+        counters['clusters'] += len({find(root, clusters) for root in cluster_roots})
+    return support, clusters
+
+
+def union_find_decoder(syndrome,L, counters=None):
+    """Initializes all data structures and runs the algorithm
+    Input:
+        syndrome: the syndrome of an error
+        counters: instrumentation counters (or None)
+    Output:
+        the edges which need to be corrected"""
+    support, clusters = grow_clusters(syndrome, L, counters)
+    edge_stabs = get_lattice(L).edge_stabs
     erasure = []
     for el in support.keys():
         if support[el] == 2:
-            erasure.append(el)  # add fully grown edges to erasure
+            erasure.append(edge_stabs[el])  # add fully grown edges to erasure
 
     return peeling_decoder(erasure, syndrome)
 
@@ -163,13 +229,26 @@ def simulate_UF(L,px):
     Output:
         True if the correction is correct
         False if the correction gives a logical error"""
+    timer = instrumentation.start('UF', L, px)
     #make the grids, generate the error and get the syndrome
     grid_g, grid_q = make_grids(L)
+    timer.stage('make_grids')
     g_errors, q_errors = generate_error(grid_g, grid_q, px)
+    timer.stage('generate_error')
     syndrome = get_syndrome(g_errors)
+    timer.stage('get_syndrome')
     #apply the decoder
-    correction = union_find_decoder(syndrome,L)
+    correction = union_find_decoder(syndrome,L, timer.counters)
+    timer.stage('decode')
     grid_corrected = apply_peeling_correction(q_errors, correction)
+    timer.stage('correct')
 
     correct = check_correction(grid_corrected)
+    timer.stage('check')
     return correct[0]
+
+
+def correct_UF(L, grid_s, grid_q, erasure):
+    """Decode a given error with union_find_decoder, True if the correction is correct"""
+    correction = union_find_decoder(get_syndrome(grid_s), L)
+    return check_correction(apply_peeling_correction(grid_q, correction))[0]
@@ -0,0 +1,198 @@
+# Benchmark the decoders: time each stage (with the instrumentation) over a grid of L and p with fixed seeds,
+# fit the scaling exponent of the time against L^2 and compare with a stored baseline
+
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import numpy as np
+import instrumentation
+from Peeling_decoder import simulate_peeling, get_syndrome
+from UF_decoder import simulate_UF, union_find_decoder
+from Toric_code import make_grids, generate_error
+from Lattice import get_lattice
+from MWPM_decoder import simulate_MWPM
+
+
+# per decoder: the simulate function and the default grid
+decoders = {
+    'MWPM': {'simulate': simulate_MWPM, 'L': [3, 5, 7, 9], 'p': [0.05, 0.1]},
+    'UF': {'simulate': simulate_UF, 'L': [9, 17, 25, 33], 'p': [0.05, 0.1]},
+    'peeling': {'simulate': simulate_peeling, 'L': [9, 17, 25, 33], 'p': [0.2, 0.4]},
+}
+
+
+def time_point(decoder, L, p, shots, seed):
+    """Time shots simulations of one (L, p), the whole simulate function without instrumentation
+    and then each stage with the instrumentation
+    Input:
+        decoder: name in decoders
+        L: gridsize
+        p: error probability
+        shots: number of simulations
+        seed: seed of the random module, the same for both runs
+    Output:
+        times: dict with the time per shot in seconds, of 'total' and of each stage"""
+    simulate = decoders[decoder]['simulate']
+    random.seed(seed)
+    start = time.perf_counter()
+    for i in range(shots):
+        simulate(L, p)
+    times = {'total': time.perf_counter() - start}
+    random.seed(seed)
+    with instrumentation.collect() as records:
+        for i in range(shots):
+            simulate(L, p)
+    for name, value in records[0].items():
+        if name.startswith('time_'):
+            times[name[len('time_'):]] = value
+    return {stage: t / shots for stage, t in times.items()}
+
+
+def fit_exponent(all_L, all_times):
+    """Fit time = c * (L^2)^a, the scaling exponent a is the slope of log(time) against log(L^2)"""
+    if len(all_L) < 2:
+        return None
+    slope, intercept = np.polyfit(np.log(np.array(all_L, dtype=float) ** 2), np.log(all_times), 1)
+    return float(slope)
+
+
+def run_benchmark(names, shots, seed, all_L=None, all_px=None):
+    """Time all decoders over their grid of L and p
+    Input:
+        names: names of the decoders to benchmark
+        shots: number of simulations per (L, p)
+        seed: seed of each (L, p)
+        all_L, all_px: the grid, the default of each decoder if None
+    Output:
+        results: dict per decoder with the 'points' [{'L', 'p', 'times'}]
+            and per p and stage the fitted 'exponents' of the time against L^2"""
+    results = {}
+    for name in names:
+        grid_L = all_L or decoders[name]['L']
+        grid_p = all_px or decoders[name]['p']
+        points = []
+        for L in grid_L:
+            for p in grid_p:
+                points.append({'L': L, 'p': p, 'times': time_point(name, L, p, shots, seed)})
+                print(name, 'L =', L, 'p =', p, 'total per shot: %.3g s' % points[-1]['times']['total'])
+        exponents = {}
+        for p in grid_p:
+            p_points = [point for point in points if point['p'] == p]
+            exponents[str(p)] = {stage: fit_exponent([point['L'] for point in p_points],
+                                                     [point['times'][stage] for point in p_points])
+                                 for stage in p_points[0]['times']}
+            print(name, 'p =', p, 'exponent of the total time against L^2: %.3f' % exponents[str(p)]['total'])
+        results[name] = {'points': points, 'exponents': exponents}
+    return results
+
+
+def time_decode(L, p, shots, seed):
+    """Time only the UF decoder, without instrumentation: the errors and syndromes are made outside the timing
+    Input:
+        L: gridsize
+        p: error probability
+        shots: number of decoded syndromes
+        seed: seed of the random module for the errors
+    Output:
+        the median decode time of the shots in seconds, a shot slowed down by other processes does not count"""
+    random.seed(seed)
+    get_lattice(L)  # build the lattice tables before the timing
+    times = []
+    for i in range(shots):
+        grid_s, grid_q = make_grids(L)
+        grid_s, grid_q = generate_error(grid_s, grid_q, p)
+        syndrome = get_syndrome(grid_s)
+        gc.disable()  # like timeit, a collection of the grids of the last shot is not decode time
+        start = time.perf_counter()
+        union_find_decoder(syndrome, L)
+        times.append(time.perf_counter() - start)
+        gc.enable()
+    return float(np.median(times))
+
+
+def scaling_check(all_L, p, shots, seed, max_exponent):
+    """Check that the decode time of the UF decoder grows almost linearly with the number of qubits
+    Input:
+        all_L: gridsizes, up to large L (e.g. 64 to 512)
+        p: error probability, high p gives the largest clusters
+        shots: number of decoded syndromes at the largest L, a smaller L decodes as many more syndromes as
+            it has fewer qubits, so every L has the same number of decoded qubits and about the same noise
+        seed: seed of each L
+        max_exponent: largest allowed exponent of the decode time against L^2
+    Output:
+        exponent: the fitted exponent of the decode time against L^2
+        results: the points and exponent, like run_benchmark"""
+    points = []
+    for L in all_L:
+        L_shots = shots * max(all_L) ** 2 // L ** 2
+        points.append({'L': L, 'p': p, 'shots': L_shots, 'times': {'decode': time_decode(L, p, L_shots, seed)}})
+        print('UF L =', L, 'p =', p, 'median decode time: %.3g s' % points[-1]['times']['decode'])
+    exponent = fit_exponent(all_L, [point['times']['decode'] for point in points])
+    print('UF p =', p, 'exponent of the decode time against L^2: %.3f (at most %.3f)' % (exponent, max_exponent))
+    return exponent, {'UF': {'points': points, 'exponents': {str(p): {'decode': exponent}}}}
+
+
+def compare(results, baseline, margin):
+    """Find the points which are slower than the baseline
+    Input:
+        results: output of run_benchmark
+        baseline: output of run_benchmark of an earlier run
+        margin: allowed relative slow down (0.2 = 20% slower)
+    Output:
+        regressions: list of strings describing each point of which the total time per shot is too large"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base_times = {(point['L'], point['p']): point['times']['total'] for point in baseline[name]['points']}
+        for point in result['points']:
+            base = base_times.get((point['L'], point['p']))
+            if base is not None and point['times']['total'] > base * (1 + margin):
+                regressions.append('%s L=%d p=%s: %.3g s per shot, baseline %.3g s' % (
+                    name, point['L'], point['p'], point['times']['total'], base))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the toric code decoders')
+    parser.add_argument('--decoders', nargs='+', default=list(decoders), choices=list(decoders))
+    parser.add_argument('--L', nargs='+', type=int, help='gridsizes (default per decoder)')
+    parser.add_argument('--p', nargs='+', type=float, help='error probabilities (default per decoder)')
+    parser.add_argument('--shots', type=int,
+                        help='simulations per (L, p), default 200 (--scaling: decoded syndromes at the largest L, '
+                             'default 20)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help='file to write the results to')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--margin', type=float, default=0.2, help='allowed slow down relative to the baseline')
+    parser.add_argument('--scaling', action='store_true',
+                        help='only check that the decode time of the UF decoder is almost linear in L^2, '
+                             'default at p = 0.1 for L = 64 to 512')
+    parser.add_argument('--max_exponent', type=float, default=1.2,
+                        help='largest allowed exponent of --scaling. The UF decoder gives 1.04 to 1.11 over seeds '
+                             '(its cost per edge grows slowly with the size of its dicts), the UF decoder before the '
+                             'bucket queue growth order gave 1.27')
+    args = parser.parse_args()
+
+    if args.scaling:
+        exponent, results = scaling_check(args.L or [64, 128, 256, 512], (args.p or [0.1])[0],
+                                          args.shots or 20, args.seed, args.max_exponent)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        sys.exit(exponent > args.max_exponent)
+
+    results = run_benchmark(args.decoders, args.shots or 200, args.seed, args.L, args.p)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.margin)
+        for regression in regressions:
+            print('slower than baseline:', regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,139 @@
+# Compare decoders on the same shots: each error is sampled once and decoded by all decoders,
+# the outcomes of a shot are kept together, so the difference between two decoders has a much smaller
+# error bar than the difference of two independent runs
+
+import argparse
+import random
+from collections import Counter
+from copy import deepcopy
+from multiprocessing import Pool
+import numpy as np
+from Toric_code import make_grids, generate_error
+from Peeling_decoder import make_erasure
+from sweep import chunk_seed, new_seed
+from registry import correct_functions, get_correct_func
+
+
+def noise_of(names):
+    """The noise model of the decoders, they must all decode the same noise"""
+    noises = {correct_functions[name][2] for name in names}
+    if len(noises) != 1:
+        raise ValueError('decoders of different noise models can not share shots: ' + ', '.join(names))
+    return noises.pop()
+
+
+def simulate_paired(L, p, names):
+    """Sample one error and decode it with all decoders
+    Input:
+        L: gridsize
+        p: error probability (or erasure probability for the erasure decoders)
+        names: names of the decoders in registry.correct_functions
+    Output:
+        outcomes: tuple with for each decoder True if the correction is correct"""
+    grid_s, grid_q = make_grids(L)
+    if noise_of(names) == 'erasure':
+        erasure, grid_s, grid_q = make_erasure(grid_s, grid_q, p)
+    else:
+        erasure = []
+        grid_s, grid_q = generate_error(grid_s, grid_q, p)
+    # every decoder gets its own copy, the corrections are added to the grids
+    correct_funcs = [get_correct_func(name)[0] for name in names]
+    return tuple(bool(correct(L, deepcopy(grid_s), deepcopy(grid_q), list(erasure))) for correct in correct_funcs)
+
+
+def run_paired_chunk(task):
+    """Simulate one chunk of shots with the random stream of the chunk, like sweep.run_chunk
+    Input:
+        task: [names, L, p, n, seed, chunk_idx]
+    Output:
+        [L, p, patterns, n]: patterns counts how often each tuple of outcomes occurred"""
+    names, L, p, n, seed, chunk_idx = task
+    random.seed(int(chunk_seed(seed, L, p, chunk_idx).generate_state(1, np.uint64)[0]))
+    patterns = Counter(simulate_paired(L, p, names) for i in range(n))
+    return [L, p, patterns, n]
+
+
+def paired_sweep(names, all_L, all_px, N, seed=0, workers=None, chunk_size=100):
+    """Simulate N shots for every (L, p), each decoded by all decoders
+    Input:
+        names: names of the decoders in registry.correct_functions
+        all_L, all_px: gridsizes and error probabilities to simulate
+        N: number of shots per (L, p)
+        seed: seed of the whole sweep, the same counts for any number of workers
+        workers: number of processes (all cores if None, 1 runs in this process)
+        chunk_size: maximum number of shots per chunk
+    Output:
+        results: dict (L, p) -> Counter of the outcome tuples (in the order of names)"""
+    noise_of(names)
+    tasks = [[names, L, p, min(chunk_size, N - start), seed, chunk_idx]
+             for L in all_L for p in all_px for chunk_idx, start in enumerate(range(0, N, chunk_size))]
+    results = {(L, p): Counter() for L in all_L for p in all_px}
+    pool = None if workers == 1 else Pool(workers)
+    try:
+        chunks = map(run_paired_chunk, tasks) if pool is None else pool.imap_unordered(run_paired_chunk, tasks)
+        for L, p, patterns, n in chunks:
+            results[(L, p)].update(patterns)
+    finally:
+        if pool is not None:
+            pool.close()
+    return results
+
+
+def decoder_records(results, names):
+    """The [L, p, k, N] records of each decoder separately, to save in a ResultsStore
+    Output:
+        records: dict decoder name -> list of [L, p, k, N]"""
+    records = {name: [] for name in names}
+    for (L, p), patterns in sorted(results.items()):
+        n = sum(patterns.values())
+        for idx, name in enumerate(names):
+            k = sum(count for outcome, count in patterns.items() if outcome[idx])
+            records[name].append([L, p, k, n])
+    return records
+
+
+def paired_difference(patterns, i, j, z=1.96):
+    """Difference of the fractions of correct shots of decoder i and decoder j on the same shots
+    Input:
+        patterns: Counter of the outcome tuples of one (L, p)
+        i, j: indices of the decoders in the outcome tuples
+        z: number of standard deviations of the interval (1.96 = 95%)
+    Output:
+        difference: fraction correct of i minus fraction correct of j
+        error_bar: z times the standard error of the difference, only the shots where they differ contribute
+        only_i, only_j: number of shots only corrected by i and only corrected by j"""
+    n = sum(patterns.values())
+    only_i = sum(count for outcome, count in patterns.items() if outcome[i] and not outcome[j])
+    only_j = sum(count for outcome, count in patterns.items() if outcome[j] and not outcome[i])
+    difference = (only_i - only_j) / n
+    variance = ((only_i + only_j) / n - difference ** 2) / max(n - 1, 1)
+    return difference, z * variance ** 0.5, only_i, only_j
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decode the same shots with several decoders')
+    parser.add_argument('--decoders', nargs='+', default=['UF', 'MWPM'], choices=list(correct_functions))
+    parser.add_argument('--L', nargs='+', type=int, default=[3, 5, 7])
+    parser.add_argument('--p', nargs='+', type=float, default=[0.09, 0.1, 0.11])
+    parser.add_argument('--N', type=int, default=1000, help='shots per (L, p)')
+    parser.add_argument('--seed', type=int, help='seed of the shots (default a new seed every run, which is printed)')
+    parser.add_argument('--workers', type=int, help='number of processes (default all cores)')
+    parser.add_argument('--save', action='store_true', help='add the counts of each decoder to the results store')
+    args = parser.parse_args()
+
+    seed = new_seed() if args.seed is None else args.seed
+    print('seed', seed)
+    results = paired_sweep(args.decoders, args.L, args.p, args.N, seed, args.workers)
+    records = decoder_records(results, args.decoders)
+    for idx, ((L, p), patterns) in enumerate(sorted(results.items())):
+        line = 'L = %d p = %s: ' % (L, p) + ', '.join(
+            '%s %.4f' % (name, records[name][idx][2] / records[name][idx][3]) for name in args.decoders)
+        for j in range(1, len(args.decoders)):
+            difference, bar, only_i, only_j = paired_difference(patterns, 0, j)
+            line += '; %s - %s = %.4f +- %.4f' % (args.decoders[0], args.decoders[j], difference, bar)
+        print(line)
+    if args.save:
+        from results import ResultsStore
+        store = ResultsStore()
+        for name in args.decoders:
+            store.append(name, records[name], seed)
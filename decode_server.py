@@ -0,0 +1,323 @@
+# Long-running decoding service, so other processes can decode syndromes without starting python for every call.
+# Listens on a Unix socket (--socket path) or reads from stdin and writes to stdout (--stdio).
+# All requests which arrived together are decoded as one batch, with the decoders of each L kept in memory.
+#
+# Binary protocol, little endian:
+#   request:  header (request_id uint32, decoder uint8, L uint16, n uint32), then n uint32 ids row*L+col
+#             of the stabilizers with -1 as outcome. Decoder 255 asks for the statistics (L and n are 0).
+#   response: header (request_id uint32, status uint8, n uint32), then for status 0 the n uint32 ids q_row*L+q_col
+#             of the qubits to flip, for status 1 an error message of n bytes, for the statistics n bytes of json.
+
+import argparse
+import json
+import os
+import selectors
+import socket
+import struct
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from math import log2
+
+request_header = struct.Struct('<IBHI')
+response_header = struct.Struct('<IBI')
+stats_code = 255
+
+
+def correct_UF_array(defects, L):
+    from UF_array_decoder import get_decoder
+    return get_decoder(L).decode_edges(defects)
+
+
+def correct_UF(defects, L):
+    from UF_decoder import union_find_decoder
+    from Lattice import get_lattice
+    lattice = get_lattice(L)
+    syndrome = defaultdict(int)  # like get_syndrome
+    for v in defects:
+        syndrome[divmod(v, L)] = 1
+    correction = union_find_decoder(syndrome, L)
+    return [lattice.edge_id(stab1, stab2) for stab1, stab2 in correction]
+
+
+def correct_MWPM(defects, L):
+    import MWPM_decoder  # networkx is only imported when a MWPM request comes in
+    matching = MWPM_decoder.decode_MWPM_defects([divmod(v, L) for v in sorted(defects)], L)
+    flipped = set()
+    for edge in MWPM_decoder.matching_to_edges(matching, L):
+        flipped ^= {edge}  # an edge on two paths is not flipped
+    return sorted(flipped)
+
+
+def correct_lookup(defects, L):
+    from lookup_decoder import decode_lookup
+    from Lattice import get_lattice
+    lattice = get_lattice(L)
+    grid_s = [[0] * L for row in range(L)]
+    for v in defects:
+        grid_s[v // L][v % L] = 1
+    return [lattice.edge_id(stab1, stab2) for stab1, stab2 in decode_lookup(grid_s)]
+
+
+# decoder code in the protocol = index in this list; function(defect ids, L) -> edge ids
+decoders = [('UF_array', correct_UF_array), ('UF', correct_UF), ('MWPM', correct_MWPM), ('lookup', correct_lookup)]
+decoder_codes = {name: code for code, (name, func) in enumerate(decoders)}
+
+
+class LatencyHistogram:
+    """Histogram of latencies with buckets of a factor 2^(1/4) (19%), from which the percentiles are read"""
+
+    buckets_per_doubling = 4
+
+    def __init__(self):
+        self.counts = {}  # bucket -> number of latencies, bucket b holds latencies up to 2^(b/4) microseconds
+        self.total = 0
+        self.sum = 0.0
+
+    def add(self, seconds):
+        bucket = int(log2(max(seconds * 1e6, 1e-3)) * self.buckets_per_doubling) + 1
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum += seconds
+
+    def percentile(self, q):
+        """Upper edge (in seconds) of the bucket which contains the q-th percentile"""
+        if not self.total:
+            return None
+        needed = q / 100 * self.total
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= needed:
+                return 2 ** (bucket / self.buckets_per_doubling) / 1e6
+        return None
+
+    def summary(self):
+        return {'count': self.total, 'mean': self.sum / self.total if self.total else None,
+                'p50': self.percentile(50), 'p99': self.percentile(99),
+                'histogram': {'%.3g' % (2 ** (bucket / self.buckets_per_doubling) / 1e6): count
+                              for bucket, count in sorted(self.counts.items())}}
+
+
+def parse_requests(buffer):
+    """Split the complete requests off the start of the buffer
+    Output:
+        requests: list of (request_id, decoder code, L, defect ids)
+        rest: the bytes of an incomplete request"""
+    requests = []
+    offset = 0
+    while len(buffer) - offset >= request_header.size:
+        request_id, code, L, n = request_header.unpack_from(buffer, offset)
+        end = offset + request_header.size + 4 * n
+        if len(buffer) < end:
+            break
+        defects = list(struct.unpack_from('<%dI' % n, buffer, offset + request_header.size))
+        requests.append((request_id, code, L, defects))
+        offset = end
+    return requests, buffer[offset:]
+
+
+def check_request(L, defects, max_L):
+    """Raises a ValueError for a gridsize outside 2..max_L (the lattice of a huge L would use up the memory)
+    and for a syndrome which no error can give, the decoders would not finish on it"""
+    if not 2 <= L <= max_L:
+        raise ValueError('L must be between 2 and ' + str(max_L))
+    if len(defects) % 2 == 1:
+        raise ValueError('odd number of defects')
+    if len(set(defects)) != len(defects) or any(v >= L * L for v in defects):
+        raise ValueError('defect ids must be different and smaller than L*L')
+
+
+def encode_request(request_id, decoder, L, defects):
+    return request_header.pack(request_id, decoder, L, len(defects)) + struct.pack('<%dI' % len(defects), *defects)
+
+
+def encode_response(request_id, status, payload):
+    """payload: list of edge ids for status 0, bytes for the other statuses"""
+    if status == 0:
+        return response_header.pack(request_id, 0, len(payload)) + struct.pack('<%dI' % len(payload), *payload)
+    return response_header.pack(request_id, status, len(payload)) + payload
+
+
+class DecodeService:
+    """Decodes batches of requests and keeps the latency statistics per decoder"""
+
+    def __init__(self, max_L=1024):
+        """max_L: largest gridsize which is decoded, requests with a larger L are refused"""
+        self.max_L = max_L
+        self.latencies = {}  # decoder name -> LatencyHistogram of the time per request
+        self.batch_sizes = {}  # number of requests in a batch -> number of batches
+
+    def warm_up(self, all_L, names=('UF_array',)):
+        """Build the lattices and decoders of these gridsizes before the first request"""
+        for name in names:
+            for L in all_L:
+                decoders[decoder_codes[name]][1]([], L)
+
+    def stats(self):
+        return {'latency': {name: histogram.summary() for name, histogram in self.latencies.items()},
+                'batch_sizes': self.batch_sizes}
+
+    def handle_batch(self, requests):
+        """Decode a batch of requests, the requests for the same decoder and L one after the other
+        Output:
+            responses: list of encoded responses, in the order of the requests"""
+        self.batch_sizes[len(requests)] = self.batch_sizes.get(len(requests), 0) + 1
+        responses = [None] * len(requests)
+        order = sorted(range(len(requests)), key=lambda i: (requests[i][1], requests[i][2]))
+        for i in order:
+            request_id, code, L, defects = requests[i]
+            if code == stats_code:
+                responses[i] = encode_response(request_id, 2, json.dumps(self.stats()).encode())
+                continue
+            try:
+                name, func = decoders[code]
+                check_request(L, defects, self.max_L)
+                start = time.perf_counter()
+                correction = func(defects, L)
+                elapsed = time.perf_counter() - start
+            except Exception as e:  # the service keeps running, the client gets the error
+                responses[i] = encode_response(request_id, 1, repr(e).encode())
+                continue
+            self.latencies.setdefault(name, LatencyHistogram()).add(elapsed)
+            responses[i] = encode_response(request_id, 0, correction)
+        return responses
+
+    def serve_stdio(self):
+        """Serve the requests from stdin, the responses are written to stdout"""
+        stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+        buffer = b''
+        while True:
+            data = stdin.read1(1 << 16)  # what has arrived, at least one byte
+            if not data:
+                return
+            requests, buffer = parse_requests(buffer + data)
+            if requests:
+                stdout.write(b''.join(self.handle_batch(requests)))
+                stdout.flush()
+
+    def serve_socket(self, path):
+        """Serve the requests of all clients connecting to the Unix socket at path,
+        the requests of all clients which are ready together form one batch"""
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        buffers = {}  # connection -> bytes of an incomplete request
+
+        def drop(connection):
+            """Close the connection of a client which closed it or went away, the other clients are served on"""
+            selector.unregister(connection)
+            connection.close()
+            del buffers[connection]
+
+        try:
+            while True:
+                batch = []  # (connection, request)
+                for key, events in selector.select():
+                    if key.fileobj is server:
+                        connection, address = server.accept()
+                        selector.register(connection, selectors.EVENT_READ)
+                        buffers[connection] = b''
+                        continue
+                    connection = key.fileobj
+                    try:
+                        data = connection.recv(1 << 16)
+                    except OSError:  # e.g. connection reset by the client
+                        data = b''
+                    if not data:  # client closed the connection
+                        drop(connection)
+                        continue
+                    requests, buffers[connection] = parse_requests(buffers[connection] + data)
+                    batch.extend((connection, request) for request in requests)
+                if batch:
+                    responses = self.handle_batch([request for connection, request in batch])
+                    for (connection, request), response in zip(batch, responses):
+                        if connection not in buffers:  # dropped at an earlier response of this batch
+                            continue
+                        try:
+                            connection.sendall(response)
+                        except OSError:  # e.g. broken pipe, the client disconnected before its response
+                            drop(connection)
+        finally:
+            server.close()
+            os.remove(path)
+
+
+class DecodeClient:
+    """Client of the service, over a Unix socket (path given) or a service started as a child process (path None)"""
+
+    def __init__(self, path=None):
+        if path is None:
+            self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--stdio'],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self.send, self.receive = self.process.stdin, self.process.stdout
+        else:
+            self.process = None
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+            self.send = self.receive = self.socket.makefile('rwb')
+        self.next_id = 0
+
+    def request(self, decoder, L, defects):
+        """Send one request, returns its request id, the response is read with response()"""
+        self.next_id += 1
+        self.send.write(encode_request(self.next_id, decoder, L, defects))
+        return self.next_id
+
+    def response(self):
+        """Read the next response
+        Output:
+            request_id, status, payload (edge ids for status 0, bytes otherwise)"""
+        self.send.flush()
+        request_id, status, n = response_header.unpack(self.receive.read(response_header.size))
+        if status == 0:
+            return request_id, status, list(struct.unpack('<%dI' % n, self.receive.read(4 * n)))
+        return request_id, status, self.receive.read(n)
+
+    def decode(self, defects, L, decoder='UF_array'):
+        """Decode one syndrome and wait for the correction
+        Input:
+            defects: ids row*L+col of the stabilizers with -1 as outcome
+            L: gridsize
+            decoder: name of a decoder in decoders
+        Output:
+            ids q_row*L+q_col of the qubits to flip"""
+        self.request(decoder_codes[decoder], L, defects)
+        request_id, status, payload = self.response()
+        if status != 0:
+            raise RuntimeError(payload.decode())
+        return payload
+
+    def stats(self):
+        """The latency statistics of the service"""
+        self.request(stats_code, 0, [])
+        return json.loads(self.response()[2].decode())
+
+    def close(self):
+        self.send.close()
+        if self.process is not None:
+            self.process.wait()
+        else:
+            self.socket.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decoding service for the toric code decoders')
+    parser.add_argument('--socket', help='path of the Unix socket to listen on')
+    parser.add_argument('--stdio', action='store_true', help='read requests from stdin, write responses to stdout')
+    parser.add_argument('--L', nargs='*', type=int, default=[], help='gridsizes to build the UF decoders for at start')
+    parser.add_argument('--max_L', type=int, default=1024, help='largest gridsize of a request, larger L are refused')
+    args = parser.parse_args()
+    service = DecodeService(args.max_L)
+    service.warm_up(args.L)
+    if args.stdio:
+        service.serve_stdio()
+    elif args.socket:
+        service.serve_socket(args.socket)
+    else:
+        parser.error('give --socket path or --stdio')
@@ -0,0 +1,116 @@
+# Optional timing of the stages of the simulate_* functions and counters of the decoders, per (decoder, L, p).
+# When disabled (the default), the simulate functions only call the no-op stage of no_timer
+
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+enabled = False
+points = {}  # (decoder, L, p) -> dict with 'shots', 'time_<stage>' in seconds and the decoder counters
+
+
+def enable(on=True):
+    """Switch the instrumentation on (or off with on=False)"""
+    global enabled
+    enabled = on
+
+
+def reset():
+    """Forget all collected timings and counters"""
+    points.clear()
+
+
+class StageTimer:
+    """Adds the time since the previous stage to the counters of one (decoder, L, p)"""
+
+    def __init__(self, counters):
+        self.counters = counters  # passed to the decoders to add their own counters
+        self.last = time.perf_counter()
+
+    def stage(self, name):
+        """The stage name has finished"""
+        now = time.perf_counter()
+        self.counters['time_' + name] += now - self.last
+        self.last = now
+
+
+class NoTimer:
+    """Timer which does nothing, used when the instrumentation is disabled"""
+    counters = None
+
+    def stage(self, name):
+        pass
+
+
+no_timer = NoTimer()
+
+
+def start(decoder, L, p):
+    """Start the instrumentation of one shot
+    Input:
+        decoder: name of the decoder
+        L: gridsize
+        p: error probability
+    Output:
+        timer: call timer.stage(name) at the end of each stage, pass timer.counters to the decoder
+            (no_timer with counters None if disabled)"""
+    if not enabled:
+        return no_timer
+    key = (decoder, L, p)
+    if key not in points:
+        points[key] = defaultdict(float)
+    points[key]['shots'] += 1
+    return StageTimer(points[key])
+
+
+def count(counters, name, n=1):
+    """Add n to a counter, counters as given by the timer (nothing happens if None)"""
+    if counters is not None:
+        counters[name] += n
+
+
+def merge(other_points):
+    """Add the points collected by another process (as returned by export(None)) to these points"""
+    for record in other_points:
+        key = (record['decoder'], record['L'], record['p'])
+        if key not in points:
+            points[key] = defaultdict(float)
+        for name, value in record.items():
+            if name not in ('decoder', 'L', 'p'):
+                points[key][name] += value
+
+
+@contextmanager
+def collect():
+    """Collect the instrumentation of a block separately, with the instrumentation enabled.
+    Afterwards the earlier points and state are restored, the records of the block are in the yielded list"""
+    global enabled
+    was_enabled = enabled
+    saved = dict(points)
+    points.clear()
+    enabled = True
+    records = []
+    try:
+        yield records
+        records.extend(export())
+    finally:
+        points.clear()
+        points.update(saved)
+        enabled = was_enabled
+
+
+def export(filename=None):
+    """Returns the totals per (decoder, L, p), and writes them to a json file if filename is given
+    Output:
+        records: list of dicts with 'decoder', 'L', 'p', 'shots' and the totals of all timings and counters,
+            divide by 'shots' for the average per shot"""
+    records = []
+    for (decoder, L, p), counters in sorted(points.items()):
+        record = {'decoder': decoder, 'L': L, 'p': p}
+        record.update(counters)
+        records.append(record)
+    if filename is not None:
+        with open(filename, 'w') as f:
+            json.dump(records, f, indent=1)
+    return records
@@ -0,0 +1,214 @@
+# Lookup table decoder for small L: the MWPM correction of every syndrome is computed once and saved.
+# Only one syndrome of each class of translations on the torus is in the table (the one with the smallest key),
+# the correction of another syndrome is the correction of its class translated back.
+# Syndrome key: bit row*L+col for stabilizer (row, col), correction: bit q_row*L+q_col for qubit (q_row, q_col)
+
+import os
+import numpy as np
+from Toric_code import make_grids, generate_error, check_correction
+from Peeling_decoder import apply_peeling_correction
+from Lattice import get_lattice
+import instrumentation
+
+max_L = 5  # the number of syndromes grows as 2^(L^2), and a correction has to fit in 64 bits
+table_directory = 'lookup_tables'  # where the tables are saved, as lookup_L<L>.npy
+tables = {}  # L -> table, loaded (memory-mapped) on first use
+masks = {}  # (n_rows, row_length) -> masks of column_masks, made on first use
+
+
+def syndrome_key(grid_s):
+    """The key of a syndrome: bit row*L+col is 1 if stabilizer (row, col) has -1 as outcome
+    Input:
+        grid_s: LxL grid with errors
+    Output:
+        key: integer"""
+    key = 0
+    bit = 1
+    for row in grid_s:
+        for value in row:
+            if value % 2 == 1:
+                key |= bit
+            bit <<= 1
+    return key
+
+
+def column_masks(n_rows, row_length):
+    """For each d_col the masks (stay, wrap) of the bits of a key which stay in their row when moved d_col columns
+    to the right and of the ones which wrap around, made once per shape of the keys"""
+    if (n_rows, row_length) not in masks:
+        masks[(n_rows, row_length)] = [
+            (sum(((1 << (row_length - d_col)) - 1) << (row * row_length) for row in range(n_rows)),
+             sum(((1 << d_col) - 1) << (row * row_length + row_length - d_col) for row in range(n_rows)))
+            for d_col in range(row_length)]
+    return masks[(n_rows, row_length)]
+
+
+def rotate_bits(key, n_rows, row_length, d_row, d_col):
+    """Move bit row*row_length+col of a key of n_rows rows to ((row+d_row) % n_rows)*row_length + (col+d_col) % row_length,
+    for integers and for numpy arrays of keys
+    Input:
+        key: key (or array of keys) with n_rows*row_length bits
+        d_row, d_col: translation, 0 <= d_row < n_rows and 0 <= d_col < row_length"""
+    n_bits = n_rows * row_length
+    full = (1 << n_bits) - 1
+    if d_row:
+        shift = d_row * row_length
+        key = ((key << shift) | (key >> (n_bits - shift))) & full
+    if d_col:
+        stay, wrap = column_masks(n_rows, row_length)[d_col]
+        key = ((key & stay) << d_col) | ((key & wrap) >> (row_length - d_col))
+    return key
+
+
+def translate_syndrome(key, L, d_row, d_col):
+    """Translate a syndrome key (or numpy array of keys) over d_row rows and d_col columns of stabilizers"""
+    return rotate_bits(key, L, L, d_row, d_col)
+
+
+def translate_correction(correction, L, d_row, d_col):
+    """Translate a correction over d_row rows and d_col columns of stabilizers (2*d_row rows of qubits)"""
+    return rotate_bits(correction, 2 * L, L, 2 * d_row, d_col)
+
+
+def canonical_key(key, L):
+    """The smallest key of all translations of a syndrome
+    Output:
+        canonical: the smallest key
+        d_row, d_col: the translation from key to canonical"""
+    n_bits = L * L
+    full = (1 << n_bits) - 1
+    col_masks = column_masks(L, L)
+    best = (key, 0, 0)
+    for d_row in range(L):
+        shift = d_row * L
+        row_key = ((key << shift) | (key >> (n_bits - shift))) & full  # translate_syndrome(key, L, d_row, 0)
+        if row_key < best[0]:
+            best = (row_key, d_row, 0)
+        for d_col in range(1, L):
+            stay, wrap = col_masks[d_col]
+            translated = ((row_key & stay) << d_col) | ((row_key & wrap) >> (L - d_col))
+            if translated < best[0]:
+                best = (translated, d_row, d_col)
+    return best
+
+
+def canonical_keys(L, chunk_size=1 << 20):
+    """All keys of syndromes (even number of defects) which are the smallest of their translations, sorted"""
+    keys = []
+    n_keys = 1 << (L * L)
+    for start in range(0, n_keys, chunk_size):
+        chunk = np.arange(start, min(start + chunk_size, n_keys), dtype=np.uint64)
+        parity = np.zeros(len(chunk), dtype=np.uint64)
+        for bit in range(L * L):
+            parity ^= (chunk >> bit) & 1
+        chunk = chunk[parity == 0]  # every error gives an even number of defects
+        smallest = np.ones(len(chunk), dtype=bool)
+        for d_row in range(L):
+            for d_col in range(L):
+                if d_row or d_col:
+                    smallest &= chunk <= translate_syndrome(chunk, L, d_row, d_col)
+        keys.append(chunk[smallest])
+    return np.concatenate(keys)
+
+
+def build_table(L, backend='networkx', progress=False):
+    """Compute the MWPM correction of every canonical syndrome
+    Input:
+        L: gridsize, at most max_L
+        backend: matching backend of decode_MWPM ('pymatching' is much faster for L=5)
+        progress: print the progress if True
+    Output:
+        table: (n, 2) uint64 array, sorted canonical keys in column 0 and their corrections in column 1"""
+    from MWPM_decoder import decode_MWPM, matching_to_edges  # networkx only when building tables
+    if L > max_L:
+        raise ValueError('lookup tables are only made up to L=' + str(max_L))
+    keys = canonical_keys(L)
+    table = np.zeros((len(keys), 2), dtype=np.uint64)
+    table[:, 0] = keys
+    for idx, key in enumerate(keys.tolist()):
+        grid_s, _ = make_grids(L)
+        for v in range(L * L):
+            if key >> v & 1:
+                grid_s[v // L][v % L] = 1
+        correction = 0
+        for edge in matching_to_edges(decode_MWPM(grid_s, backend=backend), L):
+            correction ^= 1 << edge  # an edge on two paths is not flipped
+        table[idx, 1] = correction
+        if progress and idx % 10000 == 0:
+            print('L =', L, 'syndrome', idx, 'of', len(keys))
+    return table
+
+
+def table_filename(L):
+    return os.path.join(table_directory, 'lookup_L' + str(L) + '.npy')
+
+
+def save_table(L, table):
+    """Save a table made by build_table, atomically so readers never see half a table"""
+    os.makedirs(table_directory, exist_ok=True)
+    tmp_filename = table_filename(L) + '.tmp.npy'
+    np.save(tmp_filename, table)
+    os.replace(tmp_filename, table_filename(L))
+
+
+def get_table(L):
+    """Returns the table of gridsize L, memory-mapped from its file (made with python lookup_decoder.py)"""
+    if L not in tables:
+        if not os.path.exists(table_filename(L)):
+            raise FileNotFoundError('no lookup table ' + table_filename(L) + ' for L=' + str(L) +
+                                    ', build the tables with python lookup_decoder.py')
+        tables[L] = np.load(table_filename(L), mmap_mode='r')
+    return tables[L]
+
+
+def decode_lookup(grid_s):
+    """Find the MWPM correction of a syndrome in the lookup table
+    Input:
+        grid_s: LxL grid with errors (L <= max_L)
+    Output:
+        correction: the qubits which need to be flipped, given as (stab1, stab2) for apply_peeling_correction"""
+    L = len(grid_s)
+    table = get_table(L)
+    canonical, d_row, d_col = canonical_key(syndrome_key(grid_s), L)
+    idx = int(np.searchsorted(table[:, 0], canonical))
+    if idx == len(table) or table[idx, 0] != canonical:
+        raise KeyError('syndrome ' + str(canonical) + ' is not in the lookup table of L=' + str(L))
+    # translate the correction of the canonical syndrome back to this syndrome
+    correction = translate_correction(int(table[idx, 1]), L, (L - d_row) % L, (L - d_col) % L)
+    edge_stabs = get_lattice(L).edge_stabs
+    edges = []
+    while correction:
+        lowest = correction & -correction
+        edges.append(edge_stabs[lowest.bit_length() - 1])
+        correction ^= lowest
+    return edges
+
+
+def simulate_lookup(L, px):
+    """Simulate the toric code with the lookup table decoder (the MWPM correction), for L <= max_L
+    Input:
+        L: grid size
+        px: probability on an X error (0<=px<=1)
+    Output:
+        True if correction correct
+        False if correction gives logical error
+    """
+    timer = instrumentation.start('lookup', L, px)
+    g, q = make_grids(L)
+    timer.stage('make_grids')
+    g_errors, q_errors = generate_error(g, q, px)
+    timer.stage('generate_error')
+    correction = decode_lookup(g_errors)
+    timer.stage('decode')
+    corrected_grid = apply_peeling_correction(q_errors, correction)
+    timer.stage('correct')
+    check = check_correction(corrected_grid)
+    timer.stage('check')
+    return check[0]
+
+
+if __name__ == '__main__':
+    # build the tables offline, so simulations never have to wait for them
+    for L in range(3, max_L + 1):
+        if not os.path.exists(table_filename(L)):
+            save_table(L, build_table(L, backend='pymatching', progress=True))
@@ -0,0 +1,142 @@
+# Qubit grid with each row of L qubits packed into 64-bit words, 2L x ceil(L/64) words in total
+# (256 KB at L=1000 instead of 2 million list entries). Corrections are XORed in, the logical parities are
+# popcounts and the syndrome of a whole row is computed with word shifts.
+# Bit col % 64 of word col // 64 of a row is qubit (row, col), like the grid_q of make_grids.
+
+from collections import defaultdict
+import numpy as np
+from Lattice import get_lattice
+import instrumentation
+
+word_bits = 64
+
+
+def popcount(words):
+    """Number of 1 bits in each word"""
+    if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+        return np.bitwise_count(words)
+    return np.unpackbits(words.view(np.uint8).reshape(words.shape + (8,)), axis=-1).sum(axis=-1)
+
+
+class PackedGrid:
+    """A 2L x L qubit grid packed into words"""
+
+    def __init__(self, L):
+        self.L = L
+        self.n_words = -(-L // word_bits)
+        self.words = np.zeros((2 * L, self.n_words), dtype=np.uint64)
+
+    @classmethod
+    def from_grid(cls, grid_q):
+        """Pack a qubit grid of make_grids, only the parity of each qubit counts"""
+        grid = cls(len(grid_q[0]))
+        bits = np.asarray(grid_q, dtype=np.uint8) & 1
+        packed = np.packbits(bits, axis=1, bitorder='little')
+        padded = np.zeros((2 * grid.L, grid.n_words * 8), dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        grid.words = padded.view('<u8').astype(np.uint64)
+        return grid
+
+    def to_grid(self):
+        """The qubit grid as lists, like make_grids"""
+        bits = np.unpackbits(self.words.astype('<u8').view(np.uint8), axis=1, count=self.L, bitorder='little')
+        return bits.tolist()
+
+    def copy(self):
+        grid = PackedGrid(self.L)
+        grid.words = self.words.copy()
+        return grid
+
+    def flip_edges(self, edges):
+        """Flip the qubits with edge ids q_row*L+q_col, an edge occurring twice is not flipped"""
+        edges = np.asarray(edges, dtype=np.int64)
+        rows, cols = np.divmod(edges, self.L)
+        masks = np.left_shift(np.uint64(1), (cols % word_bits).astype(np.uint64))
+        np.bitwise_xor.at(self.words, (rows, cols // word_bits), masks)
+
+    def apply_correction(self, correction):
+        """Flip the qubits of a correction given as (stab1, stab2), like apply_peeling_correction"""
+        lattice = get_lattice(self.L)
+        self.flip_edges([lattice.edge_id(stab1, stab2) for stab1, stab2 in correction])
+        return self
+
+    def xor(self, other):
+        """Add the errors of another packed grid (for example a whole correction) to this grid"""
+        self.words ^= other.words
+        return self
+
+    def shifted_columns(self, rows):
+        """The rows with every qubit col replaced by qubit (col+1) % L, with word shifts"""
+        L = self.L
+        shifted = rows >> np.uint64(1)
+        if self.n_words > 1:  # lowest bit of the next word becomes the highest bit of this word
+            shifted[:, :-1] |= rows[:, 1:] << np.uint64(word_bits - 1)
+        # qubit 0 wraps around to column L-1
+        last_word, last_bit = divmod(L - 1, word_bits)
+        shifted[:, last_word] |= (rows[:, 0] & np.uint64(1)) << np.uint64(last_bit)
+        return shifted
+
+    def syndrome_words(self):
+        """(L, n_words) packed stabilizer outcomes, bit 1 for -1, like syndrome_batch for one shot"""
+        above = self.words[0::2]  # qubits above the stabilizers (even rows)
+        left = self.words[1::2]  # qubits left of the stabilizers (odd rows)
+        return above ^ np.roll(above, -1, axis=0) ^ left ^ self.shifted_columns(left)
+
+    def defects(self):
+        """The coords of the stabilizers with -1 as outcome, in the order of get_defects"""
+        bits = np.unpackbits(self.syndrome_words().astype('<u8').view(np.uint8), axis=1, count=self.L,
+                             bitorder='little')
+        return [(int(row), int(col)) for row, col in zip(*np.nonzero(bits))]
+
+    def get_syndrome(self):
+        """The syndrome dict of get_syndrome, for union_find_decoder and peeling_decoder"""
+        syndrome = defaultdict(int)
+        for stab in self.defects():
+            syndrome[stab] = 1
+        return syndrome
+
+    def check(self):
+        """check_correction for the packed grid: (True, 'end'), (False, 'X1'), (False, 'X2') or (False, 'stab', row, col)"""
+        if int(popcount(self.words[0]).sum()) % 2 == 1:  # upper row = X1
+            return (False, 'X1')
+        if int(popcount(self.words[1::2, 0] & np.uint64(1)).sum()) % 2 == 1:  # first column of the odd rows = X2
+            return (False, 'X2')
+        syndrome = self.syndrome_words()
+        if syndrome.any():
+            row = int(np.flatnonzero(syndrome.any(axis=1))[0])
+            word = int(np.flatnonzero(syndrome[row])[0])
+            bit = int(syndrome[row, word])
+            col = word * word_bits + ((bit & -bit).bit_length() - 1)
+            return (False, 'stab', row, col)
+        return (True, 'end')
+
+
+def random_packed_error(L, px):
+    """A packed grid with an error on each qubit with probability px (sampled with geometric skips)"""
+    from sparse_errors import sample_edges
+    grid = PackedGrid(L)
+    grid.flip_edges(sample_edges(2 * L * L, px))
+    return grid
+
+
+def simulate_UF_packed(L, px):
+    """Simulate the toric code with the array-backed UF decoder on a packed qubit grid.
+    Input:
+        L: gridsize
+        px: the probability on an error
+    Output:
+        True if the correction is correct
+        False if the correction gives a logical error"""
+    from UF_array_decoder import get_decoder
+    timer = instrumentation.start('UF_packed', L, px)
+    grid = random_packed_error(L, px)
+    timer.stage('generate_error')
+    defects = grid.defects()
+    timer.stage('get_syndrome')
+    correction = get_decoder(L).decode_edges([row * L + col for row, col in defects], timer.counters)
+    timer.stage('decode')
+    grid.flip_edges(correction)
+    timer.stage('correct')
+    correct = grid.check()
+    timer.stage('check')
+    return correct[0]
@@ -0,0 +1,192 @@
+# Union-Find decoding of one large shot on several processes: the torus is split into tiles x tiles tiles,
+# the clusters of the defects of each tile are grown in a separate process with the growth of UF_decoder.
+# Clusters which never touch evolve independently of the order in which they are grown, so the clusters of all
+# tiles together are exactly the clusters of the serial decoder as long as clusters of different tiles do not
+# share a reached edge or a vertex. A cluster stops growing at the border of its tile, its defects are grown again
+# in tiles twice as large (the last time on the whole torus). Clusters of different runs which touch are combined:
+# their defects are grown again together, until no clusters of different runs touch. Then the grown edges are
+# peeled like union_find_decoder, which gives the same correction as the serial decoder.
+
+import argparse
+import os
+import random
+import time
+from multiprocessing import Pool
+from Lattice import get_lattice
+from Peeling_decoder import peeling_decoder, get_syndrome
+from UF_decoder import grow_clusters, find, union_find_decoder
+
+
+def tile_interior(L, tiles, tile):
+    """The vertices of a tile without the vertices at its border, None for one tile (the whole torus)"""
+    if tiles == 1:
+        return None
+    rows = [r for r in range(L) if r * tiles // L == tile[0]]
+    cols = [c for c in range(L) if c * tiles // L == tile[1]]
+    return {(r, c) for r in rows[1:-1] for c in cols[1:-1]}
+
+
+def grow_region(task):
+    """Grow the clusters of a part of the defects inside a tile, in a worker process
+    Input:
+        task: [defects, L, tiles, tile], defects in the order of the syndrome, tile = (row, col) of the tile
+    Output:
+        units: list of [defects, members, reached, grown, escaped] per group of clusters, with
+            members: ids of the vertices of the clusters
+            reached: ids of the (half) grown edges
+            grown: ids of the grown edges, in the order they were reached
+            escaped: True if a cluster reached the border of the tile, it stopped growing there
+            Clusters half growing the same edge from both ends are one group, as it is not known which grew it"""
+    defects, L, tiles, tile = task
+    interior = tile_interior(L, tiles, tile)
+    support, clusters = grow_clusters(defects, L, None, interior)
+    lattice = get_lattice(L)
+    edge_stabs = lattice.edge_stabs
+    root_of = {v: find(v, clusters) for v in list(clusters) if clusters[v][0] != 0}
+
+    # groups of clusters, joined by edges which are half grown between two clusters
+    group = {root: root for root in set(root_of.values())}
+
+    def group_find(x):
+        while group[x] != x:
+            group[x] = group[group[x]]
+            x = group[x]
+        return x
+
+    for e, s in support.items():
+        if s == 1:
+            u, v = edge_stabs[e]
+            if u in root_of and v in root_of:
+                group[group_find(root_of[u])] = group_find(root_of[v])
+
+    units = {}
+    for g in defects:
+        units.setdefault(group_find(root_of[g]), [[], [], [], [], False])[0].append(g)
+    for v, root in root_of.items():
+        unit = units[group_find(root)]
+        unit[1].append(lattice.vertex_id(v))
+        if interior is not None and v not in interior:
+            unit[4] = True
+    for e, s in support.items():
+        if s == 0:  # only looked up
+            continue
+        u, v = edge_stabs[e]
+        unit = units[group_find(root_of[u] if u in root_of else root_of[v])]
+        unit[2].append(e)
+        if s == 2:
+            unit[3].append(e)
+    return list(units.values())
+
+
+def warm_up(L):
+    """Build the lattice tables of L in a worker process, before the first decode"""
+    get_lattice(L).edge_stabs
+
+
+def conflicting_groups(units, runs):
+    """Find the units of different runs which reached the same edge or contain the same vertex
+    Input:
+        units: list of the units of grow_region
+        runs: for each unit the index of the run it comes from
+    Output:
+        groups: lists of indices of units which must be grown together, each with units of at least two runs"""
+    parent = list(range(len(units)))
+
+    def find_unit(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    edge_owner = {}
+    vertex_owner = {}
+    for idx, (defects, members, reached, grown, escaped) in enumerate(units):
+        for owner, keys in ((edge_owner, reached), (vertex_owner, members)):
+            for key in keys:
+                other = owner.setdefault(key, idx)
+                if runs[other] != runs[idx]:
+                    parent[find_unit(other)] = find_unit(idx)
+    groups = {}
+    for idx in range(len(units)):
+        groups.setdefault(find_unit(idx), []).append(idx)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def parallel_union_find_decoder(syndrome, L, tiles=2, pool=None):
+    """The Union-Find decoder with the clusters of each tile grown in a separate process,
+    gives the same correction as union_find_decoder
+    Input:
+        syndrome: the syndrome of an error (like get_syndrome)
+        L: gridsize
+        tiles: number of tiles in each direction, the torus is split in tiles x tiles tiles
+        pool: multiprocessing Pool of the workers (None grows all tiles in this process)
+    Output:
+        the edges which need to be corrected"""
+    order = {g: idx for idx, g in enumerate(syndrome)}
+    mapper = map if pool is None else pool.map
+    units = []
+    runs = []  # for each unit the index of the run of grow_region it comes from
+    n_runs = 0
+
+    # grow the clusters in each tile, the clusters which reach a tile border are grown again in larger tiles
+    pending = list(syndrome)
+    while pending:
+        tile_defects = {}
+        for g in pending:
+            tile_defects.setdefault((g[0] * tiles // L, g[1] * tiles // L), []).append(g)
+        tasks = [[defects, L, tiles, tile] for tile, defects in tile_defects.items()]
+        pending = []
+        for result in mapper(grow_region, tasks):
+            for unit in result:
+                if unit[4]:
+                    pending.extend(unit[0])
+                else:
+                    units.append(unit)
+                    runs.append(n_runs)
+            n_runs += 1
+        pending.sort(key=order.get)
+        tiles = max(tiles // 2, 1)
+
+    # combine the clusters of different runs which touch, grow them again together on the whole torus
+    groups = conflicting_groups(units, runs)
+    while groups:
+        tasks = [[sorted((g for idx in group for g in units[idx][0]), key=order.get), L, 1, (0, 0)]
+                 for group in groups]
+        combined = {idx for group in groups for idx in group}
+        runs = [run for idx, run in enumerate(runs) if idx not in combined]
+        units = [unit for idx, unit in enumerate(units) if idx not in combined]
+        for result in mapper(grow_region, tasks):
+            units.extend(result)
+            runs.extend([n_runs] * len(result))
+            n_runs += 1
+        groups = conflicting_groups(units, runs)
+
+    edge_stabs = get_lattice(L).edge_stabs
+    erasure = [edge_stabs[e] for unit in units for e in unit[3]]
+    return peeling_decoder(erasure, syndrome)
+
+
+if __name__ == '__main__':
+    # e.g. python parallel_decoder.py --L 512 --p 0.1 --tiles 2 --workers 4
+    parser = argparse.ArgumentParser(description='Time the tiled parallel UF decoder against the serial decoder')
+    parser.add_argument('--L', type=int, default=256)
+    parser.add_argument('--p', type=float, default=0.1)
+    parser.add_argument('--tiles', type=int, default=2, help='number of tiles in each direction')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes (default all cores)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from Toric_code import make_grids, generate_error
+    random.seed(args.seed)
+    grid_s, grid_q = make_grids(args.L)
+    grid_s, grid_q = generate_error(grid_s, grid_q, args.p)
+    with Pool(args.workers) as pool:
+        pool.map(warm_up, [args.L] * args.workers, chunksize=1)
+        start = time.perf_counter()
+        parallel = parallel_union_find_decoder(get_syndrome(grid_s), args.L, args.tiles, pool)
+        parallel_time = time.perf_counter() - start
+    start = time.perf_counter()
+    serial = union_find_decoder(get_syndrome(grid_s), args.L)
+    serial_time = time.perf_counter() - start
+    print('serial %.3f s, parallel %.3f s, same correction: %s' % (serial_time, parallel_time,
+                                                                    sorted(serial) == sorted(parallel)))
@@ -0,0 +1,145 @@
+# Estimate very small logical error rates by sampling errors of a fixed weight and reweighting to p:
+# P(fail | p) = sum over w of P(weight = w | p) * P(fail | weight = w)
+
+import random
+from math import lgamma, log, exp
+from Toric_code import make_grids
+from Lattice import get_lattice
+from registry import get_correct_func
+
+
+def fixed_weight_error(L, w, noise='pauli'):
+    """Make an error of exactly weight w, the qubits are chosen uniformly
+    Input:
+        L: gridsize
+        w: number of qubits with an error ('pauli') or of erased qubits ('erasure')
+        noise: 'pauli' or 'erasure' (an erased qubit gets an error with 50% chance, like make_erasure)
+    Output:
+        grid_s, grid_q: stabilizer and qubit grids with the error
+        erasure: the erased qubits (between which stabs), empty for 'pauli'"""
+    edge_stabs = get_lattice(L).edge_stabs
+    grid_s, grid_q = make_grids(L)
+    erasure = []
+    for edge in random.sample(range(2 * L * L), w):
+        stab1, stab2 = edge_stabs[edge]
+        if noise == 'erasure':
+            erasure.append((stab1, stab2))
+            if random.random() > 0.5:  # 50% chance on Y or Z error
+                continue
+        grid_s[stab1[0]][stab1[1]] += 1
+        grid_s[stab2[0]][stab2[1]] += 1
+        grid_q[edge // L][edge % L] += 1
+    return grid_s, grid_q, erasure
+
+
+def log_weight_probability(n, w, p):
+    """log of the binomial probability that exactly w of the n qubits have an error"""
+    return lgamma(n + 1) - lgamma(w + 1) - lgamma(n - w + 1) + w * log(p) + (n - w) * log(1 - p)
+
+
+def weight_range(L, p, w_min, tail=1e-15):
+    """The weights to sample: from w_min up to the weight above which the probability is at most tail
+    Output:
+        weights: list of weights
+        tail_probability: probability of a weight above the last weight"""
+    n = 2 * L * L
+    w = n
+    tail_probability = 0
+    while w > w_min:  # from the top down, add weights to the tail as long as it stays below tail
+        probability = exp(log_weight_probability(n, w, p))
+        if tail_probability + probability > tail:
+            break
+        tail_probability += probability
+        w -= 1
+    return list(range(w_min, w + 1)), tail_probability
+
+
+def sample_weights(correct_func, L, shots_per_weight, noise='pauli'):
+    """Decode shots_per_weight[w] random errors of each weight w
+    Output:
+        counts: dict with for each weight [number of failures, number of shots]"""
+    counts = {}
+    for w, shots in shots_per_weight.items():
+        failures = 0
+        for i in range(shots):
+            grid_s, grid_q, erasure = fixed_weight_error(L, w, noise)
+            if not correct_func(L, grid_s, grid_q, erasure):
+                failures += 1
+        counts[w] = [failures, shots]
+    return counts
+
+
+def failure_rate(counts, L, p, tail_probability=0, z=1.96):
+    """Reweight the failure counts per weight to the logical error rate at p
+    Input:
+        counts: dict with for each weight [number of failures, number of shots], as from sample_weights
+            weights which are not in counts are assumed to be always corrected (below the sampled weights)
+            or always fail (the tail above them, with probability tail_probability)
+        L: gridsize
+        p: error (or erasure) probability
+        tail_probability: probability of the weights above the sampled ones, only added to the upper bound
+        z: number of standard deviations of the interval
+    Output:
+        (estimate, lower, upper): the logical error rate and the normal interval of z standard deviations around it,
+            the variance is the sum of the weighted variances of the weights. The variance of a weight uses the
+            Agresti-Coull rate (failures + z^2/2) / (shots + z^2), so a weight without failures still adds the
+            uncertainty of its number of shots"""
+    n = 2 * L * L
+    estimate = variance = 0
+    for w, (failures, shots) in counts.items():
+        probability = exp(log_weight_probability(n, w, p))
+        rate = (failures + z * z / 2) / (shots + z * z)
+        estimate += probability * failures / shots
+        variance += probability ** 2 * rate * (1 - rate) / (shots + z * z)
+    return estimate, max(estimate - z * variance ** 0.5, 0), estimate + z * variance ** 0.5 + tail_probability
+
+
+def allocate_shots(probabilities, counts, shots, z=1.96):
+    """Spread shots over the weights in proportion to their contribution to the standard deviation of the estimate
+    (Neyman allocation): probability * sqrt(rate * (1 - rate)), with the Agresti-Coull rate of the counts so far
+    Input:
+        probabilities: dict with the probability of each weight
+        counts: dict with for each weight [number of failures, number of shots] so far
+        shots: number of shots to spread
+    Output:
+        shots_per_weight: dict with the number of shots of each weight"""
+    contributions = {}
+    for w, probability in probabilities.items():
+        failures, n = counts[w]
+        rate = (failures + z * z / 2) / (n + z * z)
+        contributions[w] = probability * (rate * (1 - rate)) ** 0.5
+    total = sum(contributions.values())
+    return {w: int(shots * contribution / total) for w, contribution in contributions.items()}
+
+
+def rare_event_estimate(decoder, L, p, shots, w_min=None, pilot_shots=20, seed=None, tail=1e-15):
+    """Estimate the logical error rate of a decoder at p with fixed weight sampling, in two stages: pilot_shots
+    for each weight, then the other shots spread over the weights by allocate_shots
+    Input:
+        decoder: name in registry.correct_functions, or (function(L, grid_s, grid_q, erasure) -> correct, noise)
+        L: gridsize
+        p: error (or erasure) probability
+        shots: total number of decoded errors
+        w_min: smallest weight to sample, lower weights are assumed to be always corrected.
+            Default: (L+1)//2 for pauli errors (decoders correct all errors of weight < L/2)
+            and L for erasures (a logical needs L erased qubits)
+        pilot_shots: number of shots of each weight in the first stage, at most half of the shots in total
+        seed: seed of the random module (not seeded if None)
+        tail: weights with together at most this probability are not sampled (added to the upper bound)
+    Output:
+        (estimate, lower, upper): the logical error rate and its confidence interval
+        counts: dict with for each weight [number of failures, number of shots], use failure_rate for other p"""
+    correct_func, noise = get_correct_func(decoder) if isinstance(decoder, str) else decoder
+    if w_min is None:
+        w_min = (L + 1) // 2 if noise == 'pauli' else L
+    if seed is not None:
+        random.seed(seed)
+    weights, tail_probability = weight_range(L, p, w_min, tail)
+    probabilities = {w: exp(log_weight_probability(2 * L * L, w, p)) for w in weights}
+    pilot = max(min(pilot_shots, shots // (2 * len(weights))), 2)
+    counts = sample_weights(correct_func, L, {w: pilot for w in weights}, noise)
+    extra = sample_weights(correct_func, L, allocate_shots(probabilities, counts, shots - pilot * len(weights)), noise)
+    for w, (failures, n) in extra.items():
+        counts[w][0] += failures
+        counts[w][1] += n
+    return failure_rate(counts, L, p, tail_probability), counts
@@ -0,0 +1,52 @@
+# The simulate functions of all decoders by name, and the functions decoding a given error for the tools which
+# decode the same shots with several decoders. A decoder module (and what it imports, like networkx for MWPM)
+# is only imported when its decoder is used
+
+import importlib
+
+# name -> (module, function) of the simulate function(L, p) -> True if the correction is correct
+simulate_functions = {
+    'MWPM': ('MWPM_decoder', 'simulate_MWPM'),
+    'MWPM_sparse': ('MWPM_decoder', 'simulate_MWPM_sparse'),
+    'UF': ('UF_decoder', 'simulate_UF'),
+    'UF_array': ('UF_array_decoder', 'simulate_UF_array'),
+    'peeling': ('Peeling_decoder', 'simulate_peeling'),
+    'UF_defects': ('sparse_errors', 'simulate_UF_defects'),  # sparse errors, for low p and large L
+    'MWPM_defects': ('sparse_errors', 'simulate_MWPM_defects'),
+    'peeling_defects': ('sparse_errors', 'simulate_peeling_defects'),
+    'UF_packed': ('packed_grid', 'simulate_UF_packed'),  # bit-packed qubit grid
+    'UF_streaming': ('streaming_decoder', 'simulate_UF_streaming'),  # 3L rounds with measurement errors
+    'lookup': ('lookup_decoder', 'simulate_lookup'),  # L <= 5, build the tables with python lookup_decoder.py
+}
+
+# name -> (module, function, noise) of the function(L, grid_s, grid_q, erasure) -> True if the correction of the
+# given error is correct, noise is the noise model it decodes: 'pauli' (errors of generate_error) or 'erasure'
+# (erasures of make_erasure)
+correct_functions = {
+    'UF': ('UF_decoder', 'correct_UF', 'pauli'),
+    'UF_array': ('UF_array_decoder', 'correct_UF_array', 'pauli'),
+    'MWPM': ('MWPM_decoder', 'correct_MWPM', 'pauli'),
+    'MWPM_sparse': ('MWPM_decoder', 'correct_MWPM_sparse', 'pauli'),
+    'peeling': ('Peeling_decoder', 'correct_peeling', 'erasure'),
+}
+
+
+def register(name, module, function):
+    """Add a decoder: the simulate function named function in module (imported when used)"""
+    simulate_functions[name] = (module, function)
+
+
+def get_sim_func(decoder):
+    """Import and return the simulate function of a decoder"""
+    if decoder not in simulate_functions:
+        raise ValueError('unknown decoder ' + str(decoder) + ', choose from ' + ', '.join(simulate_functions))
+    module, function = simulate_functions[decoder]
+    return getattr(importlib.import_module(module), function)
+
+
+def get_correct_func(decoder):
+    """Import and return the function decoding a given error of a decoder, and its noise model"""
+    if decoder not in correct_functions:
+        raise ValueError('unknown decoder ' + str(decoder) + ', choose from ' + ', '.join(correct_functions))
+    module, function, noise = correct_functions[decoder]
+    return getattr(importlib.import_module(module), function), noise
@@ -0,0 +1,182 @@
+# Append-only store of simulation results, with an index on (decoder, L, p). A line may also hold the seed of the
+# sweep it comes from, shots of the same seed are the same shots and are refused a second time
+
+import os
+from bisect import bisect_left, bisect_right
+
+try:
+    import fcntl  # file locks, not available on windows
+except ImportError:
+    fcntl = None
+
+
+def lock(f, exclusive):
+    """Lock an open file, exclusive for writers and shared for readers (no-op without fcntl)"""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def unlock(f):
+    """Release the lock of lock(f, ...)"""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def open_locked(filename):
+    """Open a file for appending with an exclusive lock. If the file was replaced by a compaction
+    while waiting for the lock, the new file is opened instead, so nothing is written to the old one"""
+    while True:
+        f = open(filename, 'a')
+        lock(f, True)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(filename).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        unlock(f)
+        f.close()
+
+
+def add_lines(text, records, by_seed=False):
+    """Add the [L, p, k, N] (or [L, p, k, N, seed]) lines of a data file to the records
+    Input:
+        text: lines of a data file
+        records: dict with (L, p) as keys and [L, p, k, N] as values, updated in place
+        by_seed: keep the lines of different seeds apart, with (L, p, seed) as keys and [L, p, k, N, seed] as values
+            (seed None for lines without seed)
+    Output:
+        new_points: True if a new key was added"""
+    new_points = False
+    for line in text.splitlines():
+        splitted = line.split()
+        if not splitted:
+            continue
+        L, p, k, N = int(splitted[0]), float(splitted[1]), int(splitted[2]), int(splitted[3])
+        key = (L, p)
+        if by_seed:
+            key = (L, p, int(splitted[4]) if len(splitted) > 4 else None)
+        if key in records:
+            records[key][2] += k
+            records[key][3] += N
+        else:
+            records[key] = [L, p, k, N] + ([key[2]] if by_seed and key[2] is not None else [])
+            new_points = True
+    return new_points
+
+
+class ResultsStore:
+    """Results of all decoders in data_<decoder>.txt files in a directory, one [L, p, k, N] record per line.
+    New counts are only appended, under a file lock and in one write, so several sweeps can save at the same time.
+    A file may contain several lines for the same (L, p), the index sums them. Only the part of a file
+    which was appended since the last read is read again."""
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.index = {}  # decoder -> {(L, p): [L, p, k, N]}
+        self.offsets = {}  # decoder -> (inode, number of bytes) of the file already in the index
+        self.sorted_p = {}  # decoder -> {L: sorted list of p}, made when needed for queries
+
+    def filename(self, decoder):
+        return os.path.join(self.directory, 'data_' + decoder + '.txt')
+
+    def append(self, decoder, data, seed=None):
+        """Add the counts to the store
+        Input:
+            decoder: name of the decoder
+            data: list of [L, p, k, N] records (new shots only)
+            seed: seed of the sweep the counts come from, saved with them. Raises a ValueError if the store
+                already has counts of the same seed for one of the (L, p): those are the same shots again"""
+        suffix = '' if seed is None else ' ' + str(seed)
+        lines = ''.join(' '.join([str(x) for x in d[:4]]) + suffix + '\n' for d in data)
+        if not lines:
+            return
+        filename = self.filename(decoder)
+        with open_locked(filename) as f:
+            try:
+                if seed is not None:
+                    saved = {}
+                    with open(filename) as current:  # also what others appended
+                        add_lines(current.read(), saved, by_seed=True)
+                    repeated = [d for d in data if (d[0], float(d[1]), seed) in saved]
+                    if repeated:
+                        raise ValueError('%s already has shots of seed %s for L=%s p=%s, these are the same shots'
+                                         % (filename, seed, repeated[0][0], repeated[0][1]))
+                f.write(lines)
+                f.flush()
+            finally:
+                unlock(f)
+
+    def refresh(self, decoder):
+        """Read the lines appended since the last refresh into the index
+        Input:
+            decoder: name of the decoder
+        Output:
+            index: dict with (L, p) as keys and the summed [L, p, k, N] as values"""
+        try:
+            with open(self.filename(decoder), 'rb') as f:
+                lock(f, False)
+                try:
+                    inode = os.fstat(f.fileno()).st_ino
+                    if self.offsets.get(decoder, (inode, 0))[0] != inode:  # compacted by someone else
+                        self.forget(decoder)
+                    f.seek(self.offsets.get(decoder, (inode, 0))[1])
+                    new = f.read()
+                finally:
+                    unlock(f)
+        except FileNotFoundError:
+            return self.index.setdefault(decoder, {})
+        index = self.index.setdefault(decoder, {})
+        end = new.rfind(b'\n') + 1  # only complete lines
+        self.offsets[decoder] = (inode, self.offsets.get(decoder, (inode, 0))[1] + end)
+        if add_lines(new[:end].decode(), index):
+            self.sorted_p.pop(decoder, None)  # new points, sorted lists are outdated
+        return index
+
+    def forget(self, decoder):
+        """Drop the index of a decoder, the next refresh reads the whole file again"""
+        self.index.pop(decoder, None)
+        self.offsets.pop(decoder, None)
+        self.sorted_p.pop(decoder, None)
+
+    def query(self, decoder, all_L=None, p_start=None, p_end=None):
+        """Returns the summed records of a decoder, ordered by L and p
+        Input:
+            decoder: name of the decoder
+            all_L: gridsizes to return, all if None
+            p_start, p_end: only p with p_start <= p <= p_end (no limit if None)
+        Output:
+            list of [L, p, k, N] records"""
+        index = self.refresh(decoder)
+        if decoder not in self.sorted_p:
+            sorted_p = {}
+            for L, p in index:
+                sorted_p.setdefault(L, []).append(p)
+            for ps in sorted_p.values():
+                ps.sort()
+            self.sorted_p[decoder] = sorted_p
+        sorted_p = self.sorted_p[decoder]
+        res = []
+        for L in sorted(sorted_p) if all_L is None else all_L:
+            ps = sorted_p.get(L, [])
+            start = 0 if p_start is None else bisect_left(ps, p_start)
+            end = len(ps) if p_end is None else bisect_right(ps, p_end)
+            res.extend([list(index[(L, p)]) for p in ps[start:end]])
+        return res
+
+    def compact(self, decoder):
+        """Rewrite the file of a decoder with one line per (L, p, seed), atomically and under the lock"""
+        filename = self.filename(decoder)
+        with open_locked(filename) as f:
+            try:
+                self.forget(decoder)
+                with open(filename, 'rb') as current:  # read everything, also what others appended
+                    new = current.read()
+                records = {}
+                add_lines(new.decode(), records, by_seed=True)
+                tmp_filename = filename + '.tmp'
+                with open(tmp_filename, 'w') as tmp:
+                    for d in records.values():
+                        tmp.write(' '.join([str(x) for x in d]) + '\n')
+                os.replace(tmp_filename, filename)
+            finally:
+                unlock(f)
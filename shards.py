@@ -0,0 +1,175 @@
+# Split a sweep into shards which run as separate processes on different machines, and merge their results.
+# A shard spec is a json file with the decoder, seed, chunk_size and the shot ranges [L, p, start, stop] it runs.
+# Shot range [start, stop) of (L, p) is made of the chunks start/chunk_size, ... which get the random streams of
+# sweep.chunk_seed, so the shards together give exactly the counts of one sweep with the same seed.
+# The output of a shard is a Checkpoint file: the spec on the first line, then one [L, p, chunk_idx, k, n] line
+# per finished chunk, so an interrupted shard resumes where it stopped. Merging refuses chunks counted twice.
+
+import argparse
+import glob
+import json
+import os
+from multiprocessing import Pool
+import instrumentation
+from sweep import Checkpoint, run_tasks, new_seed
+from registry import simulate_functions, get_sim_func
+
+
+def make_shards(decoder, all_L, all_px, N, n_shards, seed=None, chunk_size=100):
+    """Split N shots of every (L, p) over n_shards shards, every shard gets a part of the chunks of every point
+    Input:
+        decoder: name in registry.simulate_functions
+        all_L, all_px: gridsizes and error probabilities of the sweep
+        N: number of shots per (L, p)
+        n_shards: number of shards
+        seed: seed of the whole sweep (a new seed if None)
+        chunk_size: number of shots per chunk
+    Output:
+        specs: list of shard specs (dicts)"""
+    if seed is None:
+        seed = new_seed()
+    n_chunks = -(-N // chunk_size)
+    specs = []
+    for shard in range(n_shards):
+        # the chunks of this shard, about the same number for every shard
+        first = shard * n_chunks // n_shards
+        last = (shard + 1) * n_chunks // n_shards
+        ranges = [[L, p, first * chunk_size, min(last * chunk_size, N)]
+                  for L in all_L for p in all_px if last > first]
+        specs.append({'decoder': decoder, 'seed': seed, 'chunk_size': chunk_size, 'shard': shard,
+                      'n_shards': n_shards, 'ranges': ranges})
+    return specs
+
+
+def write_shards(specs, directory):
+    """Write each spec to directory/shard_<i>.json, returns the filenames"""
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for spec in specs:
+        filenames.append(os.path.join(directory, 'shard_' + str(spec['shard']) + '.json'))
+        with open(filenames[-1], 'w') as f:
+            json.dump(spec, f)
+    return filenames
+
+
+def shard_tasks(spec, sim_func):
+    """The tasks of sweep.run_chunk for all chunks of a shard spec"""
+    chunk_size = spec['chunk_size']
+    tasks = []
+    for L, p, start, stop in spec['ranges']:
+        if start % chunk_size != 0:
+            raise ValueError('shot range of L=' + str(L) + ' p=' + str(p) + ' does not start at a chunk')
+        for begin in range(start, stop, chunk_size):
+            tasks.append([sim_func, L, p, min(chunk_size, stop - begin), spec['seed'], begin // chunk_size,
+                          instrumentation.enabled])
+    return tasks
+
+
+def run_shard(spec_filename, output=None, workers=None):
+    """Run the chunks of a shard which are not finished yet, saving them to the output file
+    Input:
+        spec_filename: the json file of the shard spec
+        output: the output file (default: the spec filename with .out.jsonl)
+        workers: number of processes (all cores if None, 1 runs in this process)
+    Output:
+        output: the filename of the output"""
+    with open(spec_filename) as f:
+        spec = json.load(f)
+    if output is None:
+        output = os.path.splitext(spec_filename)[0] + '.out.jsonl'
+    checkpoint = Checkpoint(output, spec)
+    tasks = [task for task in shard_tasks(spec, get_sim_func(spec['decoder']))
+             if (task[1], task[2], task[5]) not in checkpoint.done]
+    if workers == 1:
+        run_tasks(tasks, [], None, checkpoint)
+    else:
+        with Pool(workers) as pool:
+            run_tasks(tasks, [], pool, checkpoint)
+    checkpoint.close()
+    return output
+
+
+def read_output(filename):
+    """Returns the spec and the finished chunks {(L, p, chunk_idx): [k, n]} of a shard output,
+    without the last line if it was only partly written"""
+    with open(filename) as f:
+        lines = f.read().split('\n')
+    chunks = {}
+    for line in lines[1:-1]:
+        L, p, chunk_idx, k, n = json.loads(line)
+        chunks[(L, p, chunk_idx)] = [k, n]
+    return json.loads(lines[0]), chunks
+
+
+def merge_shards(filenames):
+    """Sum the counts of the outputs of shards. Chunk i of (L, p) is the start of random stream
+    chunk_seed(seed, L, p, i) for any chunk_size, so two chunks with the same decoder, seed, L, p and chunk index
+    share shots (also with different chunk sizes) and would be counted twice: this raises a ValueError
+    Input:
+        filenames: output files of run_shard
+    Output:
+        data: dict (decoder, seed) -> list of [L, p, k, N] records, ordered by L and p
+        missing: number of chunks of the specs which are not in the outputs (unfinished shards)"""
+    seen = {}  # (decoder, seed, L, p, chunk_idx) -> filename
+    totals = {}  # (decoder, seed) -> {(L, p): [L, p, k, N]}
+    missing = 0
+    for filename in filenames:
+        spec, chunks = read_output(filename)
+        source = (spec['decoder'], spec['seed'])
+        for (L, p, chunk_idx), (k, n) in chunks.items():
+            key = source + (L, p, chunk_idx)
+            if key in seen:
+                raise ValueError('chunk ' + str(chunk_idx) + ' of L=' + str(L) + ' p=' + str(p) + ' with seed ' +
+                                 str(spec['seed']) + ' is in ' + seen[key] + ' and in ' + filename)
+            seen[key] = filename
+            record = totals.setdefault((spec['decoder'], spec['seed']), {}).setdefault((L, p), [L, p, 0, 0])
+            record[2] += k
+            record[3] += n
+        for L, p, start, stop in spec['ranges']:
+            for begin in range(start, stop, spec['chunk_size']):
+                if (L, p, begin // spec['chunk_size']) not in chunks:
+                    missing += 1
+    data = {source: [records[key] for key in sorted(records)] for source, records in totals.items()}
+    return data, missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a sweep as shards on several machines')
+    commands = parser.add_subparsers(dest='command', required=True)
+    split = commands.add_parser('split', help='write the shard specs of a sweep')
+    split.add_argument('--decoder', required=True, choices=list(simulate_functions))
+    split.add_argument('--L', nargs='+', type=int, required=True)
+    split.add_argument('--p', nargs='+', type=float, required=True)
+    split.add_argument('--N', type=int, required=True, help='shots per (L, p)')
+    split.add_argument('--shards', type=int, required=True)
+    split.add_argument('--seed', type=int, help='seed of the sweep (default a new seed, saved in the specs)')
+    split.add_argument('--chunk_size', type=int, default=100)
+    split.add_argument('--directory', default='shards')
+    run = commands.add_parser('run', help='run one shard')
+    run.add_argument('spec')
+    run.add_argument('--output', help='output file (default <spec>.out.jsonl)')
+    run.add_argument('--workers', type=int, help='number of processes (default all cores)')
+    merge = commands.add_parser('merge', help='sum the outputs of the shards')
+    merge.add_argument('outputs', nargs='+', help='output files (or glob patterns)')
+    merge.add_argument('--save', action='store_true', help='append the merged counts to the results store')
+    args = parser.parse_args()
+
+    if args.command == 'split':
+        specs = make_shards(args.decoder, args.L, args.p, args.N, args.shards, args.seed, args.chunk_size)
+        for filename in write_shards(specs, args.directory):
+            print(filename)
+    elif args.command == 'run':
+        print(run_shard(args.spec, args.output, args.workers))
+    else:
+        filenames = sorted({filename for pattern in args.outputs for filename in glob.glob(pattern)})
+        data, missing = merge_shards(filenames)
+        if missing:
+            print('warning:', missing, 'chunks are not finished yet')
+        for (decoder, seed), records in data.items():
+            for record in records:
+                print(decoder, *record, 'seed', seed)
+        if args.save:
+            from results import ResultsStore
+            store = ResultsStore()
+            for (decoder, seed), records in data.items():
+                store.append(decoder, records, seed)
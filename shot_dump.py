@@ -0,0 +1,172 @@
+# Binary files with pregenerated shots, to replay the same errors with several decoders or runs.
+# Layout: a header (magic, json length, json with L, p, noise, seed, shots and the record sizes),
+# padded to a multiple of 64 bytes, followed by one fixed size record per shot:
+#   error bits (2L^2 qubits, bit q_row*L+q_col), syndrome bits (L^2 stabilizers, bit row*L+col)
+#   and for the erasure noise the erasure bits (2L^2 qubits), each part packed into bytes (little bit order).
+# The records are read with numpy.memmap, so only the shots which are used are read from disk.
+
+import json
+import numpy as np
+from Toric_code import generate_error_batch
+from Peeling_decoder import make_erasure_batch, erasure_mask_to_edges
+from sweep import chunk_seed
+from registry import correct_functions, get_correct_func
+
+magic = b'TCSHOTS1'
+header_alignment = 64
+
+
+def packed_size(n_bits):
+    return (n_bits + 7) // 8
+
+
+def pack(bits):
+    """Pack a (shots, ...) array of 0/1 values into (shots, bytes) uint8, bit i of a shot in byte i//8"""
+    return np.packbits(np.asarray(bits, dtype=np.uint8).reshape(len(bits), -1), axis=1, bitorder='little')
+
+
+def unpack(packed, shape):
+    """Inverse of pack, returns a (shots,) + shape uint8 array"""
+    n_bits = int(np.prod(shape))
+    return np.unpackbits(packed, axis=1, count=n_bits, bitorder='little').reshape((len(packed),) + shape)
+
+
+def write_dump(filename, L, p, shots, noise='pauli', seed=0, chunk_shots=10000):
+    """Generate shots with the batched error functions and write them to a dump file, chunk by chunk
+    Input:
+        filename: file to write
+        L: gridsize
+        p: error probability ('pauli') or erasure probability ('erasure', like make_erasure)
+        shots: number of shots
+        noise: 'pauli' or 'erasure'
+        seed: seed of the shots, chunk i is made with chunk_seed(seed, L, p, i)
+        chunk_shots: number of shots generated at once
+    Output:
+        header: the header written to the file"""
+    if noise not in ('pauli', 'erasure'):
+        raise ValueError('unknown noise model ' + str(noise))
+    error_bytes = packed_size(2 * L * L)
+    header = {'L': L, 'p': p, 'noise': noise, 'seed': seed, 'shots': shots, 'chunk_shots': chunk_shots,
+              'error_bytes': error_bytes, 'syndrome_bytes': packed_size(L * L),
+              'erasure_bytes': error_bytes if noise == 'erasure' else 0}
+    with open(filename, 'wb') as f:
+        f.write(encode_header(header))
+        for chunk_idx, start in enumerate(range(0, shots, chunk_shots)):
+            n = min(chunk_shots, shots - start)
+            rng = np.random.default_rng(chunk_seed(seed, L, p, chunk_idx))
+            if noise == 'pauli':
+                parts = generate_error_batch(L, p, n, rng)
+            else:
+                erasures, errors, syndromes = make_erasure_batch(L, p, n, rng)
+                parts = (errors, syndromes, erasures)
+            f.write(np.concatenate([pack(part) for part in parts], axis=1).tobytes())
+    return header
+
+
+def encode_header(header):
+    text = json.dumps(header).encode()
+    size = len(magic) + 4 + len(text)
+    padding = -size % header_alignment
+    return magic + len(text).to_bytes(4, 'little') + text + b' ' * padding
+
+
+def read_header(filename):
+    """Returns the header of a dump file and the offset of the first record"""
+    with open(filename, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(filename + ' is not a shot dump')
+        length = int.from_bytes(f.read(4), 'little')
+        header = json.loads(f.read(length).decode())
+    size = len(magic) + 4 + length
+    return header, size + (-size % header_alignment)
+
+
+class ShotDump:
+    """The shots of a dump file, memory-mapped"""
+
+    def __init__(self, filename):
+        self.header, offset = read_header(filename)
+        for name in ('L', 'p', 'noise', 'seed', 'shots'):
+            setattr(self, name, self.header[name])
+        self.error_bytes = self.header['error_bytes']
+        self.syndrome_bytes = self.header['syndrome_bytes']
+        self.erasure_bytes = self.header['erasure_bytes']
+        record_bytes = self.error_bytes + self.syndrome_bytes + self.erasure_bytes
+        self.records = np.memmap(filename, dtype=np.uint8, mode='r', offset=offset,
+                                 shape=(self.shots, record_bytes))
+
+    def __len__(self):
+        return self.shots
+
+    def errors(self, start=0, stop=None):
+        """(shots, 2L, L) uint8 array of the errors of shots start up to stop"""
+        return unpack(self.records[start:stop, :self.error_bytes], (2 * self.L, self.L))
+
+    def syndromes(self, start=0, stop=None):
+        """(shots, L, L) uint8 array of the syndromes of shots start up to stop, 1 for -1 as outcome"""
+        begin = self.error_bytes
+        return unpack(self.records[start:stop, begin:begin + self.syndrome_bytes], (self.L, self.L))
+
+    def erasures(self, start=0, stop=None):
+        """(shots, 2L, L) bool array of the erased qubits of shots start up to stop (only for erasure noise)"""
+        if not self.erasure_bytes:
+            raise ValueError('the shots of this dump have no erasures')
+        begin = self.error_bytes + self.syndrome_bytes
+        return unpack(self.records[start:stop, begin:], (2 * self.L, self.L)).astype(bool)
+
+    def chunks(self, chunk_shots=10000, start=0, stop=None):
+        """Yields (errors, syndromes, erasures) arrays of chunk_shots shots at a time, erasures is None for pauli noise"""
+        stop = self.shots if stop is None else stop
+        for begin in range(start, stop, chunk_shots):
+            end = min(begin + chunk_shots, stop)
+            erasures = self.erasures(begin, end) if self.erasure_bytes else None
+            yield self.errors(begin, end), self.syndromes(begin, end), erasures
+
+    def shot(self, idx):
+        """One shot as the grids of make_grids and the erasure list of make_erasure
+        Output:
+            grid_s, grid_q: stabilizer and qubit grid (lists) with the error
+            erasure: the erased qubits (between which stabs), empty for pauli noise"""
+        grid_q = self.errors(idx, idx + 1)[0].tolist()
+        grid_s = self.syndromes(idx, idx + 1)[0].tolist()
+        erasure = erasure_mask_to_edges(self.erasures(idx, idx + 1)[0]) if self.erasure_bytes else []
+        return grid_s, grid_q, erasure
+
+
+def replay(filename, decoder, start=0, stop=None, chunk_shots=10000):
+    """Decode the shots of a dump file
+    Input:
+        filename: the dump file
+        decoder: name in registry.correct_functions, or (function(L, grid_s, grid_q, erasure) -> correct, noise)
+        start, stop: the shots to decode (all by default)
+    Output:
+        [L, p, k, N]: k of the N shots are corrected, like the records of sweep"""
+    correct_func, noise = get_correct_func(decoder) if isinstance(decoder, str) else decoder
+    dump = ShotDump(filename)
+    if noise != dump.noise:
+        raise ValueError('the decoder needs ' + noise + ' noise, the dump has ' + dump.noise + ' noise')
+    k = n = 0
+    for errors, syndromes, erasures in dump.chunks(chunk_shots, start, stop):
+        for idx in range(len(errors)):
+            erasure = erasure_mask_to_edges(erasures[idx]) if erasures is not None else []
+            k += bool(correct_func(dump.L, syndromes[idx].tolist(), errors[idx].tolist(), erasure))
+            n += 1
+    return [dump.L, dump.p, k, n]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Write a file with pregenerated shots, or replay one with a decoder')
+    parser.add_argument('filename')
+    parser.add_argument('--L', type=int, help='gridsize of the shots to write')
+    parser.add_argument('--p', type=float, help='error (or erasure) probability of the shots to write')
+    parser.add_argument('--shots', type=int, default=10000)
+    parser.add_argument('--noise', default='pauli', choices=['pauli', 'erasure'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', help='decoder to decode the shots of the file with',
+                        choices=list(correct_functions))
+    args = parser.parse_args()
+    if args.replay:
+        print(replay(args.filename, args.replay))
+    else:
+        print(write_dump(args.filename, args.L, args.p, args.shots, args.noise, args.seed))
@@ -1,8 +1,9 @@
-from MWPM_decoder import simulate_MWPM
-from Peeling_decoder import simulate_peeling
-from UF_decoder import simulate_UF
-import matplotlib.pyplot as plt
+import argparse
 from collections import defaultdict
+from registry import simulate_functions, get_sim_func
+from sweep import sweep, adaptive_sweep, threshold_sweep, std, new_seed, Checkpoint, checkpoint_filename
+from results import ResultsStore
+import instrumentation
 
 
 def gen_px_delta(start, end, delta):  # generate px
@@ -15,93 +16,35 @@ def gen_px_delta(start, end, delta):  # generate px
     return res
 
 
-def std(n_correct, n_samples):  # standard deviation for errorbars
-    correct_part = n_correct * (1 - n_correct / n_samples) ** 2
-    fail_part = (n_samples - n_correct) * (n_correct / n_samples) ** 2
-    total = ((correct_part + fail_part) / (n_samples * (n_samples - 1))) ** 0.5
-    return total
-
-
-if __name__ == '__main__':
-    # decoder = 'MWPM'
-    decoder = 'UF'
-    # decoder = 'peeling'
-
-    # gridsizes to simulate:
-    # all_L = [3,5,7,9] #MWPM
-    all_L = [9, 17, 25, 33, 41]  # UF
-
-    N = 1000  # number of simulations
-    delta_p = 0.001  # distance between px # 0.00x = 0.x%
-    p_start = 0.09
-    p_end = 0.12
-    plot_file_name = decoder + '_L=' + ','.join([str(x) for x in all_L]) + '_N=' + str(
-        N) + 'p_start=' + str(p_start).replace('.', ',') + 'p_end=' + str(p_end).replace('.', ',') + '.png'
-    tex_plot = False
-    save_data = True
-    plot_all = True  # plot all available data if True, else only data from this run
-    data_filename = 'data_' + decoder + '.txt'
-    # odd: threshold around 0.1
-    # even: threshold around 0.12
-    if tex_plot:
-        file_name = 'tex' + plot_file_name
-
-    if decoder == 'MWPM':
-        sim_func = simulate_MWPM
-    elif decoder == 'UF':
-        sim_func = simulate_UF
-    elif decoder == 'peeling':
-        sim_func = simulate_peeling
-    else:
-        sim_func = False
-    data = []
-    all_px = gen_px_delta(p_start, p_end, delta_p)
-    for L in all_L:
-        print('L = ', L)
-        for p_idx in range(len(all_px)):
-            p = all_px[p_idx]
-            if p_idx%3 == 0:
-                print('progress: ', 100*round(p_idx/len(all_px),3), '%')
-            k = 0
-            for i in range(N):
-                result = sim_func(L, p)
-                if result:
-                    k += 1
-            data.append([L, p, k, N])
-
-
-    if save_data:
-        all_data = []
-        try:
-            with open(data_filename, 'r') as f:
-                for line in f:
-                    splitted = line.split()
-                    all_data.append([int(splitted[0]), float(splitted[1]), int(splitted[2]), int(splitted[3])])
-        except FileNotFoundError:
-            print('File not found yet')
-
-        # processing:
-        for new_data in data:
-            for old_data in all_data:
-                if new_data[0] == old_data[0] and new_data[1] == old_data[1]:
-                    # data point found -> add new data
-                    old_data[2] += new_data[2]
-                    old_data[3] += new_data[3]
-                    break
-            else:
-                # if not found:
-                all_data.append(new_data)
-
-        with open(data_filename, 'w') as f:
-            for d in all_data:
-                f.write(' '.join([str(x) for x in d]))
-                f.write('\n')
-
-    # plotting:
-    if plot_all:
-        plot_data = all_data
-    else:
-        plot_data = data
+def coarse_grid(start, end, n):
+    """n evenly spaced p from start to end"""
+    return [round(start + i * (end - start) / (n - 1), 6) for i in range(n)] if n > 1 else [start]
+
+
+def print_threshold(decoder, data, estimate, all_L, uniform_shots):
+    """Print the result of threshold_sweep and the number of shots it used
+    Input:
+        uniform_shots: the number of shots per L of a uniform grid with the same resolution, to compare with"""
+    shots = sum(el[3] for el in data) // len(all_L)
+    print(decoder, 'threshold search:', shots, 'shots per L (a uniform grid of the same resolution:', uniform_shots, ')')
+    if estimate is None:
+        print(decoder, 'the curves do not cross between p_start and p_end, change the range')
+        return
+    print(decoder, 'crossing in', estimate['interval'], 'bisected to', estimate['bracket'])
+    if estimate['threshold'] is not None:
+        print(decoder, 'threshold = %.5f +- %.5f (L = %d and %d)' % (estimate['threshold'], estimate['error'],
+                                                                     min(all_L), max(all_L)))
+    for (L1, L2), fit in estimate['pairs'].items():
+        if fit is not None:
+            print(decoder, '  L = %d and %d cross at %.5f +- %.5f' % (L1, L2, fit[0], fit[1]))
+
+
+def plot(decoder, plot_data, all_L, p_start, p_end, plot_file_name, tex_plot=False, show=True):
+    """Plot the fraction of correct shots against p for each L, matplotlib is only imported here"""
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg')  # no window needed
+    import matplotlib.pyplot as plt
     if tex_plot:
         plt.rc('text', usetex=True)
     p_x = defaultdict(list)
@@ -123,4 +66,106 @@ if __name__ == '__main__':
     plt.legend()
 
     plt.savefig(plot_file_name)
-    plt.show()
+    if show:
+        plt.show()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate a decoder on the toric code over a range of L and p')
+    parser.add_argument('--decoder', default='UF', choices=list(simulate_functions))
+    parser.add_argument('--L', nargs='+', type=int, default=[9, 17, 25, 33, 41], help='gridsizes to simulate')
+    parser.add_argument('--N', type=int, default=1000, help='number of simulations (maximum number if adaptive)')
+    parser.add_argument('--p_start', type=float, default=0.09)
+    parser.add_argument('--p_end', type=float, default=0.12)
+    parser.add_argument('--delta_p', type=float, default=0.001, help='distance between the p')
+    parser.add_argument('--seed', type=int,
+                        help='seed of the sweep, the same seed gives the same results for any number of workers '
+                             '(default a new seed every run, which is printed)')
+    parser.add_argument('--workers', type=int, help='number of processes (default all cores)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='keep simulating each point until its error bar is at most target_error')
+    parser.add_argument('--target_error', type=float, default=0.01,
+                        help='half width of the 95%% interval of the fraction of correct shots')
+    parser.add_argument('--threshold', action='store_true',
+                        help='search the threshold: a coarse grid of coarse_points p from p_start to p_end, then '
+                             'bisection where the curves of the smallest and largest L cross')
+    parser.add_argument('--coarse_points', type=int, default=5, help='number of p of the coarse grid of --threshold')
+    parser.add_argument('--tolerance', type=float, default=0.0005,
+                        help='--threshold bisects until the interval of the crossing is at most this wide')
+    parser.add_argument('--no_checkpoint', action='store_true',
+                        help='do not save finished chunks to checkpoint_<decoder>_<hash of the settings>.jsonl '
+                             'to resume from')
+    parser.add_argument('--instrument', action='store_true',
+                        help='time the stages and count decoder internals, saved to instrumentation_<decoder>.json')
+    parser.add_argument('--no_save', action='store_true', help='do not add the results to the results store')
+    parser.add_argument('--headless', action='store_true', help='no plot, matplotlib is not imported')
+    parser.add_argument('--no_show', action='store_true', help='only save the plot, do not show it')
+    parser.add_argument('--this_run', action='store_true', help='only plot the data of this run, not all saved data')
+    parser.add_argument('--tex_plot', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    # e.g. python simulate.py --decoder MWPM --L 3 5 7 9 --headless
+    # or python simulate.py --decoder UF --L 9 17 25 --threshold --p_start 0.08 --p_end 0.12 --headless
+    # odd: threshold around 0.1
+    # even: threshold around 0.12
+    args = parse_args()
+    decoder = args.decoder
+    all_L = args.L
+    N = args.N
+    p_start, p_end = args.p_start, args.p_end
+    plot_file_name = decoder + '_L=' + ','.join([str(x) for x in all_L]) + '_N=' + str(
+        N) + 'p_start=' + str(p_start).replace('.', ',') + 'p_end=' + str(p_end).replace('.', ',') + '.png'
+    if args.tex_plot:
+        plot_file_name = 'tex' + plot_file_name
+
+    sim_func = get_sim_func(decoder)
+    seed = new_seed() if args.seed is None else args.seed
+    print('seed', seed, '(repeat this run with --seed ' + str(seed) + ')')
+    if args.instrument:
+        instrumentation.enable()
+    if args.threshold:
+        all_px = coarse_grid(p_start, p_end, args.coarse_points)
+    else:
+        all_px = gen_px_delta(p_start, p_end, args.delta_p)
+    checkpoint = None
+    if not args.no_checkpoint:
+        config = {'decoder': decoder, 'all_L': all_L, 'all_px': all_px, 'N': N, 'seed': seed,
+                  'adaptive': args.adaptive, 'target_error': args.target_error}
+        if args.threshold:
+            config.update({'threshold': True, 'tolerance': args.tolerance})
+        checkpoint = Checkpoint(checkpoint_filename('checkpoint_' + decoder, config), config)
+        print('checkpoint', checkpoint.filename)
+        if checkpoint.done:
+            print('resuming,', len(checkpoint.done), 'chunks already finished')
+    estimate = None
+    if args.threshold:
+        data, estimate = threshold_sweep(sim_func, all_L, all_px, N, seed=seed, workers=args.workers,
+                                         tolerance=args.tolerance, checkpoint=checkpoint)
+    elif args.adaptive:
+        data = adaptive_sweep(sim_func, all_L, all_px, args.target_error, N, seed=seed, workers=args.workers,
+                              checkpoint=checkpoint)
+    else:
+        data = sweep(sim_func, all_L, all_px, N, seed=seed, workers=args.workers, checkpoint=checkpoint)
+
+    if args.instrument:
+        instrumentation.export('instrumentation_' + decoder + '.json')
+
+    store = ResultsStore()
+    if not args.no_save:
+        try:
+            store.append(decoder, data, seed)
+        except ValueError as error:
+            print('not saved:', error)
+    if checkpoint is not None:
+        checkpoint.remove()  # all results are saved (or not wanted), a next run starts again
+
+    if args.threshold:
+        print_threshold(decoder, data, estimate, all_L, len(gen_px_delta(p_start, p_end, args.tolerance)) * N)
+    if args.headless:
+        for el in data:
+            print(decoder, *el)
+    else:
+        plot_data = data if args.this_run else store.query(decoder, all_L)
+        plot(decoder, plot_data, all_L, p_start, p_end, plot_file_name, args.tex_plot, not args.no_show)
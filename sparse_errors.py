@@ -0,0 +1,129 @@
+# Errors as lists of edge ids and syndromes as lists of vertex ids, for low p and large L.
+# The errors are sampled by skipping a geometric number of qubits, so the time of a shot is
+# proportional to the number of errors instead of to the 2L^2 qubits, and no grids are made.
+# Ids as in Lattice: vertex (row, col) has id row*L+col, edge (q_row, q_col) has id q_row*L+q_col
+
+from collections import defaultdict
+from math import log
+from random import random
+from Lattice import get_lattice
+from Peeling_decoder import peeling_decoder
+from UF_array_decoder import get_decoder
+import instrumentation
+
+
+def sample_edges(n, p):
+    """Each of the n edges independently with probability p, by geometric skips between the chosen edges
+    Input:
+        n: number of edges
+        p: probability of each edge
+    Output:
+        edges: sorted list of the chosen edge ids"""
+    if p <= 0:
+        return []
+    if p >= 1:
+        return list(range(n))
+    log_q = log(1 - p)
+    edges = []
+    e = int(log(1 - random()) / log_q)  # number of edges skipped before the first chosen one
+    while e < n:
+        edges.append(e)
+        e += int(log(1 - random()) / log_q) + 1
+    return edges
+
+
+def defects_of_edges(edges, L):
+    """The syndrome of an error on the edges: the vertices next to an odd number of them
+    Input:
+        edges: edge ids with an error, an edge occurring twice has no error
+        L: gridsize
+    Output:
+        defects: set of the ids of the vertices with -1 as outcome"""
+    lattice = get_lattice(L)
+    defects = set()
+    for e in edges:
+        defects ^= {lattice.edge_u[e], lattice.edge_v[e]}
+    return defects
+
+
+def check_edges(edges, L):
+    """check_correction for the error and correction given as edge ids
+    Input:
+        edges: edge ids of the error and of the correction, an edge occurring twice has no error
+        L: gridsize
+    Output:
+        (True, 'end') if the correction is correct, else (False, 'X1'), (False, 'X2') or (False, 'stab', row, col)"""
+    if sum(1 for e in edges if e < L) % 2 == 1:  # upper row of qubits
+        return (False, 'X1')
+    if sum(1 for e in edges if e % L == 0 and (e // L) % 2 == 1) % 2 == 1:  # first column of the odd rows
+        return (False, 'X2')
+    defects = defects_of_edges(edges, L)
+    if defects:
+        return (False, 'stab') + divmod(min(defects), L)
+    return (True, 'end')
+
+
+def simulate_UF_defects(L, px):
+    """simulate_UF_array with the sparse error, syndrome and correction
+    Input:
+        L: gridsize
+        px: the probability on an error
+    Output:
+        True if the correction is correct
+        False if the correction gives a logical error"""
+    timer = instrumentation.start('UF_defects', L, px)
+    error = sample_edges(2 * L * L, px)
+    timer.stage('generate_error')
+    defects = list(defects_of_edges(error, L))
+    timer.stage('get_syndrome')
+    correction = get_decoder(L).decode_edges(defects, timer.counters)
+    timer.stage('decode')
+    correct = check_edges(error + correction, L)
+    timer.stage('check')
+    return correct[0]
+
+
+def simulate_MWPM_defects(L, px):
+    """simulate_MWPM_sparse with the sparse error, syndrome and correction
+    Input:
+        L: gridsize
+        px: the probability on an error
+    Output:
+        True if the correction is correct
+        False if the correction gives a logical error"""
+    import MWPM_decoder  # networkx only when the MWPM decoder is used
+    timer = instrumentation.start('MWPM_defects', L, px)
+    error = sample_edges(2 * L * L, px)
+    timer.stage('generate_error')
+    stab_errors = [divmod(v, L) for v in sorted(defects_of_edges(error, L))]
+    timer.stage('get_syndrome')
+    matching = MWPM_decoder.decode_MWPM_defects(stab_errors, L, MWPM_decoder.sparse_k,
+                                                MWPM_decoder.sparse_backend, timer.counters)
+    timer.stage('decode')
+    correct = check_edges(error + MWPM_decoder.matching_to_edges(matching, L), L)
+    timer.stage('check')
+    return correct[0]
+
+
+def simulate_peeling_defects(L, pe):
+    """simulate_peeling with the sparse erasure, syndrome and correction
+    Input:
+        L: gridsize
+        pe: probability on erasure error
+    Output:
+        True if the correction is correct
+        False if the correction gives a logical error"""
+    timer = instrumentation.start('peeling_defects', L, pe)
+    lattice = get_lattice(L)
+    erased = sample_edges(2 * L * L, pe)
+    error = [e for e in erased if random() <= 0.5]  # 50% chance on Y or Z error
+    timer.stage('generate_error')
+    syndrome = defaultdict(int)
+    for v in defects_of_edges(error, L):
+        syndrome[v] = 1
+    timer.stage('get_syndrome')
+    correction = peeling_decoder([(lattice.edge_u[e], lattice.edge_v[e]) for e in erased], syndrome)
+    timer.stage('decode')
+    correct = check_edges(error + [lattice.edge_between(u, v) for u, v in correction], L)
+    timer.stage('check')
+    return correct[0]
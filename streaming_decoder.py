@@ -0,0 +1,226 @@
+# Union-Find decoder for repeated rounds of noisy syndrome measurements, in a sliding window over time.
+# Vertices of the space-time graph are (t, v): stabilizer id v = row*L+col in round t of the window.
+# The defects are the changes of the measured syndrome between two rounds. A space edge between (t, u) and (t, v)
+# is a qubit error in round t, a time edge between (t, v) and (t+1, v) a measurement error of stabilizer v.
+# The window is decoded as one graph, the corrections of its oldest rounds are committed and the window moves on,
+# so the memory only depends on the size of the window and not on the number of rounds.
+
+from collections import deque, defaultdict
+from UF_decoder import find, find_counted, union, GrowQueue
+from Peeling_decoder import peeling_decoder, get_syndrome, apply_peeling_correction
+from Toric_code import make_grids, generate_error, check_correction
+from Lattice import get_lattice
+import instrumentation
+from random import random
+
+
+def grow_window(cluster_roots, boundaries, support, clusters, neighbours, counters=None):
+    """grow of UF_decoder on the space-time graph of a window
+    Input:  cluster_roots:  list of roots of the clusters which must be grown
+            boundaries:     dict with the boundary vertices for each cluster_root, as dict keys (an ordered set)
+            support:        dict with edges (vertex1, vertex2) as keys, 0, 1 or 2 as value
+            clusters:       dict where all elements link to their parents
+            neighbours:     function which returns the neighbouring vertices of a vertex
+            counters:       instrumentation counters (or None)
+    Output: final_roots:    list of the roots of the odd clusters which have been changed (grown/merged)"""
+    # growth
+    fusion_edges = []
+    for u in cluster_roots:
+        for v in boundaries[u]:
+            for w in neighbours(v):
+                edge = (v, w) if v < w else (w, v)
+                if support[edge] == 0:
+                    support[edge] += 1
+                elif support[edge] == 1:
+                    support[edge] += 1
+                    fusion_edges.append(edge)
+    if counters is not None:
+        counters['growth_rounds'] += 1
+        counters['fusion_edges'] += len(fusion_edges)
+
+    # fusion of clusters and of their boundary lists
+    new_roots = set()
+    found_roots = set()
+    for u, v in fusion_edges:
+        if counters is None:
+            u_root = find(u, clusters)
+            v_root = find(v, clusters)
+        else:
+            u_root = find_counted(u, clusters, counters)
+            v_root = find_counted(v, clusters, counters)
+        if u_root == v_root:
+            continue
+        found_roots.add(u_root)
+        found_roots.add(v_root)
+        if clusters[u_root][1] < clusters[v_root][1]:
+            u_root, v_root = v_root, u_root  # smallest is v_root
+        if len(boundaries[v_root]) == 0:  # v_root is a single vertex, no real cluster
+            boundaries[u_root][v_root] = None
+        else:  # add the smallest boundary to the largest
+            if len(boundaries[u_root]) < len(boundaries[v_root]):
+                boundaries[u_root], boundaries[v_root] = boundaries[v_root], boundaries[u_root]
+            boundaries[u_root].update(boundaries[v_root])
+            del boundaries[v_root]
+        instrumentation.count(counters, 'merges')
+        union(u_root, v_root, clusters)
+        new_roots.discard(v_root)
+        if clusters[u_root][2] % 2 == 1:
+            new_roots.add(u_root)
+
+    # remove the vertices of which all edges are fully grown from the boundaries
+    for u in new_roots:
+        boundary = boundaries[u]
+        inner = [v for v in boundary if all(support[(v, w) if v < w else (w, v)] == 2 for w in neighbours(v))]
+        for v in inner:
+            del boundary[v]
+    for x in cluster_roots:  # roots of the clusters which have not merged keep their boundary
+        if x not in found_roots:
+            new_roots.add(x)
+    return list(new_roots)
+
+
+class SlidingWindowUFDecoder:
+    """Decodes a stream of syndrome rounds with a window of `window` rounds, of which the oldest `commit` rounds
+    are committed after each decode. The newest round of an open window is connected to a vertex 'future',
+    so clusters which are still odd can end there, to be decided by the next window."""
+
+    def __init__(self, L, window, commit):
+        """window: number of rounds decoded at once, commit: number of rounds committed each time (< window)"""
+        if not 0 < commit < window:
+            raise ValueError('need 0 < commit < window')
+        self.L = L
+        self.window = window
+        self.commit = commit
+        self.lattice = get_lattice(L)
+
+    def decode_stream(self, rounds, counters=None):
+        """Decode the syndrome rounds one by one, yields the corrections as soon as they are committed
+        Input:
+            rounds: iterable with for each round the measured syndrome, the coords of the stabilizers with -1 as outcome.
+                The last round must be a perfect measurement (for example from measuring all qubits)
+            counters: instrumentation counters (or None)
+        Output (yields):
+            the qubits which need to be flipped, as (stab1, stab2) for apply_peeling_correction,
+            once for every commit rounds and once at the end"""
+        L = self.L
+        previous = set()
+        window = deque()  # the defect ids of each round in the window, oldest first
+        for syndrome in rounds:
+            measured = {row * L + col for row, col in syndrome}
+            window.append(measured ^ previous)  # a defect where the outcome changed
+            previous = measured
+            if len(window) == self.window:
+                yield self.decode_window(window, self.commit, True, counters)
+        if window:  # the rest, up to the perfect last round
+            yield self.decode_window(window, len(window), False, counters)
+
+    def decode_window(self, window, n_commit, open_end, counters=None):
+        """Decode the rounds in the window, commit the corrections of the oldest n_commit rounds and remove them
+        Input:
+            window: deque with the set of defect ids of each round, updated in place
+            n_commit: number of rounds to commit
+            open_end: True if more rounds follow, then the newest round is connected to the future vertex
+            counters: instrumentation counters (or None)
+        Output:
+            the committed qubit corrections, as (stab1, stab2)"""
+        lattice = self.lattice
+        last = len(window) - 1
+        future = (last + 1, -1) if open_end else None
+
+        def neighbours(vertex):
+            t, v = vertex
+            res = [(t, u) for u in lattice.neighbours[4 * v:4 * v + 4]]
+            if t > 0:
+                res.append((t - 1, v))
+            if t < last:
+                res.append((t + 1, v))
+            elif future is not None:
+                res.append(future)
+            return res
+
+        defects = [(t, v) for t in range(len(window)) for v in sorted(window[t])]
+        support = defaultdict(int)
+        boundaries = defaultdict(dict)
+        clusters = defaultdict(lambda: [0, 1, 0])
+        if future is not None:  # larger than any cluster, so it stays the root once reached and never grows
+            clusters[future] = [future, lattice.n_vertices * len(window) + 1, 0]
+        grow_order = GrowQueue()  # clusters by boundary size, in order of entry for the same size
+        for g in defects:
+            clusters[g][0] = g
+            clusters[g][2] = 1
+            boundaries[g] = {g: None}
+            grow_order.push(1, g)
+        while grow_order:
+            size, root = grow_order.pop()
+            # skip stale entries, even clusters and clusters which reached the future
+            if clusters[root][0] != root or len(boundaries[root]) != size:
+                instrumentation.count(counters, 'stale_skips')
+                continue
+            if clusters[root][2] % 2 == 0 or root == future or size == 0:
+                continue
+            for el in grow_window([root], boundaries, support, clusters, neighbours, counters):
+                grow_order.push(len(boundaries[el]), el)
+        if counters is not None:  # the clusters after growth, each with its own root (the future is one cluster)
+            counters['clusters'] += len({find(g, clusters) for g in defects})
+
+        # peel, the edges to the future first so the future is the root of its tree and keeps the odd defect
+        erasure = [(future, edge[0]) for edge in support if support[edge] == 2 and edge[1] == future]
+        erasure += [edge for edge in support if support[edge] == 2 and edge[1] != future]
+        syndrome = defaultdict(int)
+        for g in defects:
+            syndrome[g] = 1
+        correction = []
+        for u, v in peeling_decoder(erasure, syndrome):
+            if u == future or v == future:
+                continue  # decided by the next window
+            (t_u, id_u), (t_v, id_v) = u, v
+            if t_u == t_v:  # qubit error
+                if t_u < n_commit:
+                    correction.append(lattice.edge_stabs[lattice.edge_between(id_u, id_v)])
+            elif min(t_u, t_v) == n_commit - 1:  # measurement error crossing into the next window
+                window[n_commit] ^= {id_u}
+        for t in range(n_commit):
+            window.popleft()
+        return correction
+
+
+def noisy_rounds(grid_s, grid_q, px, pm, n_rounds):
+    """Rounds of qubit errors and noisy syndrome measurements, the errors are added to the grids
+    Input:
+        grid_s, grid_q: the stabilizer and qubit grid
+        px: probability on an error of each qubit in each round
+        pm: probability on a wrong outcome of each stabilizer measurement
+        n_rounds: number of noisy rounds, followed by one perfect round
+    Output (yields):
+        the measured syndrome of each round, coords of the stabilizers with -1 as outcome"""
+    for i in range(n_rounds):
+        grid_s, grid_q = generate_error(grid_s, grid_q, px)
+        measured = set(get_syndrome(grid_s))
+        for row in range(len(grid_s)):
+            for col in range(len(grid_s)):
+                if random() <= pm:
+                    measured ^= {(row, col)}
+        yield sorted(measured)
+    yield list(get_syndrome(grid_s))
+
+
+def simulate_UF_streaming(L, px, n_rounds=None, window=None, commit=None):
+    """Simulate n_rounds noisy rounds (measurement error probability = px) and a perfect round, decoded with a sliding window
+    Input:
+        L: gridsize
+        px: the probability on an error of each qubit in each round, and on a wrong measurement outcome
+        n_rounds: number of noisy rounds (default 3L)
+        window, commit: rounds in the window and rounds committed at once (default 2L and L)
+    Output:
+        True if the correction is correct
+        False if the correction gives a logical error"""
+    timer = instrumentation.start('UF_streaming', L, px)
+    decoder = SlidingWindowUFDecoder(L, window or 2 * L, commit or L)
+    grid_s, grid_q = make_grids(L)
+    timer.stage('make_grids')
+    for correction in decoder.decode_stream(noisy_rounds(grid_s, grid_q, px, px, n_rounds or 3 * L), timer.counters):
+        grid_q = apply_peeling_correction(grid_q, correction)
+    timer.stage('decode')
+    correct = check_correction(grid_q)
+    timer.stage('check')
+    return correct[0]
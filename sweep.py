@@ -0,0 +1,424 @@
+# Run a sweep over gridsizes and error probabilities on multiple cores, with an independent random stream per chunk,
+# for a fixed number of shots or until the error bars are small enough, or search the threshold by bisection
+
+import hashlib
+import json
+import os
+import random
+import time
+from multiprocessing import Pool
+import numpy as np
+import instrumentation
+from results import fcntl, unlock
+
+
+def std(n_correct, n_samples):  # standard deviation for errorbars
+    correct_part = n_correct * (1 - n_correct / n_samples) ** 2
+    fail_part = (n_samples - n_correct) * (n_correct / n_samples) ** 2
+    total = ((correct_part + fail_part) / (n_samples * (n_samples - 1))) ** 0.5
+    return total
+
+
+def wilson_interval(n_correct, n_samples, z=1.96):
+    """Wilson score interval of the fraction of correct shots, also useful when all or no shots are correct
+    Input:
+        n_correct: number of correct shots
+        n_samples: number of shots
+        z: number of standard deviations (1.96 = 95%)
+    Output:
+        (lower, upper) bounds of the fraction"""
+    p = n_correct / n_samples
+    denominator = 1 + z ** 2 / n_samples
+    center = (p + z ** 2 / (2 * n_samples)) / denominator
+    half_width = z * (p * (1 - p) / n_samples + z ** 2 / (4 * n_samples ** 2)) ** 0.5 / denominator
+    return center - half_width, center + half_width
+
+
+def error_bar(n_correct, n_samples, method='wilson'):
+    """Size of the error bar of a point: half the width of the Wilson interval, or the std
+    Input:
+        n_correct: number of correct shots
+        n_samples: number of shots
+        method: 'wilson' or 'std'
+    Output:
+        error bar, infinite if there are less than 2 shots"""
+    if n_samples < 2:
+        return float('inf')
+    if method == 'std':
+        return std(n_correct, n_samples)
+    lower, upper = wilson_interval(n_correct, n_samples)
+    return (upper - lower) / 2
+
+
+def new_seed():
+    """A fresh seed for a sweep from the entropy of the OS, print or save it to repeat the sweep"""
+    return int(np.random.SeedSequence().entropy)
+
+
+def chunk_seed(seed, L, p, chunk_idx):
+    """Make the seed sequence of a chunk of shots. Depends only on the chunk itself,
+    so results do not depend on the number of workers or the order in which chunks are run
+    Input:
+        seed: seed of the whole sweep
+        L: gridsize
+        p: error probability
+        chunk_idx: index of the chunk within the (L, p) point
+    Output:
+        numpy SeedSequence for the chunk"""
+    return np.random.SeedSequence([seed, L, int(round(p * 10 ** 6)), chunk_idx])
+
+
+def make_tasks(sim_func, all_L, all_px, N, seed=0, chunk_size=100):
+    """Split N shots for every (L, p) into chunks
+    Input:
+        sim_func: function(L, p) that simulates one shot and returns True if the correction is correct
+        all_L: gridsizes to simulate
+        all_px: error probabilities to simulate
+        N: number of shots per (L, p)
+        seed: seed of the whole sweep
+        chunk_size: maximum number of shots per chunk
+    Output:
+        tasks: list of [sim_func, L, p, n, seed, chunk_idx, instrumented]"""
+    tasks = []
+    for L in all_L:
+        for p in all_px:
+            for chunk_idx, start in enumerate(range(0, N, chunk_size)):
+                n = min(chunk_size, N - start)
+                tasks.append([sim_func, L, p, n, seed, chunk_idx, instrumentation.enabled])
+    return tasks
+
+
+def run_chunk(task):
+    """Simulate one chunk of shots, seeding the random module of this process with the stream of the chunk
+    Input:
+        task: [sim_func, L, p, n, seed, chunk_idx, instrumented] as made by make_tasks
+    Output:
+        [L, p, k, n, chunk_idx, records]: number of correct shots k out of n,
+            records are the instrumentation records of the chunk (None if not instrumented)"""
+    sim_func, L, p, n, seed, chunk_idx, instrumented = task
+    random.seed(int(chunk_seed(seed, L, p, chunk_idx).generate_state(1, np.uint64)[0]))
+    if not instrumented:
+        return [L, p, simulate_chunk(sim_func, L, p, n), n, chunk_idx, None]
+    with instrumentation.collect() as records:
+        k = simulate_chunk(sim_func, L, p, n)
+    return [L, p, k, n, chunk_idx, records]
+
+
+def simulate_chunk(sim_func, L, p, n):
+    """Returns the number of correct shots out of n"""
+    k = 0
+    for i in range(n):
+        if sim_func(L, p):
+            k += 1
+    return k
+
+
+def merge_counts(results, data=None):
+    """Add the counts of chunks to the [L, p, k, N] records with the same L and p,
+    and the instrumentation records of the chunks to the instrumentation of this process
+    Input:
+        results: iterable of [L, p, k, n] (or [L, p, k, n, chunk_idx, instrumentation records] from run_chunk)
+        data: existing list of [L, p, k, N] records (new list if None)
+    Output:
+        data: list of [L, p, k, N] records, updated in place"""
+    if data is None:
+        data = []
+    index = {(d[0], d[1]): d for d in data}
+    for result in results:
+        L, p, k, n = result[:4]
+        if len(result) > 5 and result[5] is not None:
+            instrumentation.merge(result[5])
+        if (L, p) in index:
+            index[(L, p)][2] += k
+            index[(L, p)][3] += n
+        else:
+            index[(L, p)] = [L, p, k, n]
+            data.append(index[(L, p)])
+    return data
+
+
+def checkpoint_filename(prefix, config):
+    """The checkpoint file of a sweep configuration: prefix_<hash of config>.jsonl, so sweeps with different
+    configurations in the same directory have different checkpoints"""
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+    return prefix + '_' + digest + '.jsonl'
+
+
+class Checkpoint:
+    """The finished chunks of a sweep, appended to a file (one json line per chunk) at regular intervals.
+    The first line holds the configuration of the sweep, a checkpoint of another configuration is refused.
+    As every chunk has its own random stream, the finished chunks are all that is needed to resume.
+    The file is locked while the sweep runs, a second sweep using the same checkpoint is refused"""
+
+    def __init__(self, filename, config, interval=60):
+        """Open the checkpoint file, reading the chunks which are already finished
+        Input:
+            filename: the checkpoint file, made if it does not exist
+            config: dict with the configuration of the sweep (json compatible)
+            interval: seconds between writes of the finished chunks to the file"""
+        self.filename = filename
+        self.interval = interval
+        self.done = {}  # (L, p, chunk_idx) -> [k, n]
+        self.pending = []
+        self.last_write = time.time()
+        config = json.loads(json.dumps(config))  # same types as after reading it back
+        while True:
+            self.lock_file = open(filename, 'a')
+            if fcntl is not None:
+                try:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    self.lock_file.close()
+                    raise ValueError('checkpoint ' + filename + ' is used by another running sweep')
+            # the file may have been removed by a finished sweep just before it was locked
+            if os.path.exists(filename) and os.fstat(self.lock_file.fileno()).st_ino == os.stat(filename).st_ino:
+                break
+            self.close()
+        if os.path.getsize(filename) > 0:
+            with open(filename) as f:
+                lines = f.read().split('\n')
+            if json.loads(lines[0]) != config:
+                self.close()
+                raise ValueError('checkpoint ' + filename + ' belongs to another sweep configuration')
+            for line in lines[1:-1]:  # the last part is empty or a partly written line
+                L, p, chunk_idx, k, n = json.loads(line)
+                self.done[(L, p, chunk_idx)] = [k, n]
+            with open(filename, 'w') as f:  # drop a partly written line
+                f.write('\n'.join(lines[:-1]) + '\n')
+        else:
+            with open(filename, 'w') as f:
+                f.write(json.dumps(config) + '\n')
+
+    def add(self, L, p, chunk_idx, k, n):
+        """A chunk has finished, it is written to the file when the interval has passed"""
+        self.done[(L, p, chunk_idx)] = [k, n]
+        self.pending.append([L, p, chunk_idx, k, n])
+        if time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """Append the finished chunks which are not in the file yet"""
+        if self.pending:
+            with open(self.filename, 'a') as f:
+                f.write(''.join(json.dumps(chunk) + '\n' for chunk in self.pending))
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending = []
+        self.last_write = time.time()
+
+    def close(self):
+        """Release the lock of the checkpoint file, another sweep may use it now"""
+        if not self.lock_file.closed:
+            unlock(self.lock_file)
+            self.lock_file.close()
+
+    def remove(self):
+        """Remove the checkpoint file, when the results are saved elsewhere"""
+        os.remove(self.filename)
+        self.close()
+
+
+def run_tasks(tasks, data, pool=None, checkpoint=None):
+    """Run the chunks (in the pool, or in this process if None) and add them to data and the checkpoint"""
+    results = map(run_chunk, tasks) if pool is None else pool.imap_unordered(run_chunk, tasks)
+    try:
+        for result in results:
+            merge_counts([result], data)
+            if checkpoint is not None:
+                checkpoint.add(result[0], result[1], result[4], result[2], result[3])
+    finally:
+        if checkpoint is not None:
+            checkpoint.write()  # also when interrupted
+    return data
+
+
+def start_from_checkpoint(all_L, all_px, checkpoint):
+    """The [L, p, k, N] records with the counts of the chunks which are already finished"""
+    data = merge_counts([[L, p, 0, 0] for L in all_L for p in all_px])
+    if checkpoint is not None:
+        merge_counts([[L, p, k, n] for (L, p, chunk_idx), (k, n) in checkpoint.done.items()], data)
+    return data
+
+
+def sweep(sim_func, all_L, all_px, N, seed=0, workers=None, chunk_size=100, checkpoint=None):
+    """Simulate N shots for every (L, p), spread in chunks over a process pool
+    Input:
+        sim_func: function(L, p) that simulates one shot, must be importable by the workers
+        all_L: gridsizes to simulate
+        all_px: error probabilities to simulate
+        N: number of shots per (L, p)
+        seed: seed of the whole sweep, the same seed and chunk_size give the same counts for any number of workers
+        workers: number of processes (all cores if None, 1 runs in this process)
+        chunk_size: maximum number of shots per chunk
+        checkpoint: Checkpoint to resume from and to save the finished chunks to (None: no checkpoint)
+    Output:
+        data: list of [L, p, k, N] records, ordered by L and p"""
+    tasks = make_tasks(sim_func, all_L, all_px, N, seed, chunk_size)
+    data = start_from_checkpoint(all_L, all_px, checkpoint)
+    if checkpoint is not None:
+        tasks = [task for task in tasks if (task[1], task[2], task[5]) not in checkpoint.done]
+    if workers == 1:
+        run_tasks(tasks, data, None, checkpoint)
+    else:
+        with Pool(workers) as pool:
+            run_tasks(tasks, data, pool, checkpoint)
+    return data
+
+
+def adaptive_sweep(sim_func, all_L, all_px, target, max_shots, seed=0, workers=None, chunk_size=100,
+                   budget=None, method='wilson', checkpoint=None):
+    """Simulate every (L, p) until its error bar is at most target or it has max_shots shots.
+    Each round gives one more chunk to every point which is not finished yet, the points with
+    the largest error bars first, so those also get the last shots of the budget
+    Input:
+        sim_func: function(L, p) that simulates one shot, must be importable by the workers
+        all_L: gridsizes to simulate
+        all_px: error probabilities to simulate
+        target: error bar (as fraction, see error_bar) at which a point is finished
+        max_shots: maximum number of shots per (L, p)
+        seed: seed of the whole sweep, chunks get the same streams as in sweep
+        workers: number of processes (all cores if None, 1 runs in this process)
+        chunk_size: maximum number of shots per chunk
+        budget: maximum number of shots of the whole sweep (no limit if None)
+        method: 'wilson' or 'std', see error_bar
+        checkpoint: Checkpoint to resume from and to save the finished chunks to (None: no checkpoint)
+    Output:
+        data: list of [L, p, k, N] records, ordered by L and p"""
+    data = start_from_checkpoint(all_L, all_px, checkpoint)
+    n_chunks = {(L, p): 0 for L in all_L for p in all_px}
+    used = 0
+    if checkpoint is not None:
+        for (L, p, chunk_idx), (k, n) in checkpoint.done.items():
+            n_chunks[(L, p)] = max(n_chunks[(L, p)], chunk_idx + 1)
+            used += n
+    pool = None if workers == 1 else Pool(workers)
+    try:
+        while True:
+            open_points = [d for d in data if d[3] < max_shots and error_bar(d[2], d[3], method) > target]
+            open_points.sort(key=lambda d: error_bar(d[2], d[3], method), reverse=True)
+            tasks = []
+            for L, p, k, n_done in open_points:
+                n = min(chunk_size, max_shots - n_done)
+                if budget is not None:
+                    n = min(n, budget - used)
+                if n <= 0:
+                    break
+                tasks.append([sim_func, L, p, n, seed, n_chunks[(L, p)], instrumentation.enabled])
+                n_chunks[(L, p)] += 1
+                used += n
+            if not tasks:
+                return data
+            run_tasks(tasks, data, pool, checkpoint)
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def run_points(sim_func, all_L, all_px, N, seed, data, pool=None, chunk_size=100, checkpoint=None):
+    """Simulate N shots for every (L, p) and add them to data, the chunks in the checkpoint are not run again"""
+    tasks = make_tasks(sim_func, all_L, all_px, N, seed, chunk_size)
+    if checkpoint is not None:
+        merge_counts([[L, p, k, n] for (L, p, chunk_idx), (k, n) in checkpoint.done.items()
+                      if L in all_L and p in all_px], data)
+        tasks = [task for task in tasks if (task[1], task[2], task[5]) not in checkpoint.done]
+    return run_tasks(tasks, data, pool, checkpoint)
+
+
+def fraction_difference(data, L_small, L_large, p):
+    """Fraction of correct shots of L_large minus that of L_small at p, positive below the threshold
+    Output:
+        difference, variance of the difference (from the Wilson intervals, never 0)"""
+    counts = {(d[0], d[1]): d for d in data}
+    difference = 0
+    variance = 0
+    for L, sign in ((L_large, 1), (L_small, -1)):
+        L, p, k, n = counts[(L, p)]
+        difference += sign * k / n
+        variance += (error_bar(k, n) / 1.96) ** 2
+    return difference, variance
+
+
+def crossing_estimate(data, L_small, L_large, p_low, p_high):
+    """Estimate where the curves of L_small and L_large cross with a weighted linear fit of their difference
+    against p, using all points in [p_low, p_high]
+    Output:
+        (p, error): the crossing and its standard deviation, None if there are less than 2 points
+            or the difference does not decrease with p"""
+    points = sorted({d[1] for d in data if p_low <= d[1] <= p_high})
+    points = [p for p in points if any(d[:2] == [L_small, p] for d in data) and
+              any(d[:2] == [L_large, p] for d in data)]
+    if len(points) < 2:
+        return None
+    p_mid = (p_low + p_high) / 2  # center p for a stable fit
+    differences, variances = zip(*[fraction_difference(data, L_small, L_large, p) for p in points])
+    X = np.array([[1, p - p_mid] for p in points])
+    W = np.diag(1 / np.array(variances))
+    cov = np.linalg.inv(X.T @ W @ X)
+    a, b = cov @ X.T @ W @ np.array(differences)  # difference = a + b (p - p_mid)
+    if b >= 0:
+        return None
+    crossing = -a / b
+    # delta method: d crossing / da = -1/b, d crossing / db = a/b^2
+    gradient = np.array([-1 / b, a / b ** 2])
+    return float(p_mid + crossing), float(np.sqrt(gradient @ cov @ gradient))
+
+
+def threshold_sweep(sim_func, all_L, all_px, N, seed=0, workers=None, chunk_size=100, tolerance=0.0005,
+                    max_steps=10, checkpoint=None):
+    """Search the threshold: simulate a coarse grid of p, find the two neighbouring p between which the curves
+    of the smallest and largest L cross and bisect that interval, each step simulating all L at the middle.
+    The threshold is then fitted with crossing_estimate through all points of the interval
+    Input:
+        sim_func: function(L, p) that simulates one shot, must be importable by the workers
+        all_L: gridsizes to simulate
+        all_px: the coarse grid of error probabilities
+        N: number of shots per (L, p)
+        seed: seed of the whole sweep, chunks get the same streams as in sweep
+        workers: number of processes (all cores if None, 1 runs in this process)
+        chunk_size: maximum number of shots per chunk
+        tolerance: bisection stops when the interval is at most this wide
+        max_steps: maximum number of bisection steps
+        checkpoint: Checkpoint to resume from and to save the finished chunks to (None: no checkpoint),
+            a resumed search takes the same steps
+    Output:
+        data: list of [L, p, k, N] records of all simulated points, ordered by L and p
+        estimate: None if the curves do not cross in the coarse grid, else a dict with
+            'threshold', 'error': crossing of the smallest and largest L and its standard deviation
+                (None if the fit fails)
+            'interval': [p_low, p_high] the coarse interval of the crossing
+            'bracket': [p_low, p_high] the interval after bisection
+            'pairs': for each pair of consecutive L the fitted (crossing, error) or None"""
+    all_L = sorted(all_L)
+    all_px = sorted(all_px)
+    L_small, L_large = all_L[0], all_L[-1]
+    data = []
+    pool = None if workers == 1 else Pool(workers)
+    try:
+        run_points(sim_func, all_L, all_px, N, seed, data, pool, chunk_size, checkpoint)
+        signs = [fraction_difference(data, L_small, L_large, p)[0] > 0 for p in all_px]
+        crossings = [idx for idx in range(len(all_px) - 1) if signs[idx] and not signs[idx + 1]]
+        if not crossings:
+            data.sort(key=lambda d: (d[0], d[1]))
+            return data, None
+        low, high = all_px[crossings[0]], all_px[crossings[0] + 1]
+        interval = [low, high]
+
+        for step in range(max_steps):
+            middle = round((low + high) / 2, 6)  # chunk_seed distinguishes p up to 10^-6
+            if high - low <= tolerance or middle in (low, high):
+                break
+            run_points(sim_func, all_L, [middle], N, seed, data, pool, chunk_size, checkpoint)
+            if fraction_difference(data, L_small, L_large, middle)[0] > 0:
+                low = middle
+            else:
+                high = middle
+    finally:
+        if pool is not None:
+            pool.close()
+
+    data.sort(key=lambda d: (d[0], d[1]))
+    fit = crossing_estimate(data, L_small, L_large, *interval)
+    estimate = {'threshold': fit[0] if fit else None, 'error': fit[1] if fit else None,
+                'interval': interval, 'bracket': [low, high],
+                'pairs': {(L1, L2): crossing_estimate(data, L1, L2, *interval) for L1, L2 in zip(all_L, all_L[1:])}}
+    return data, estimate